@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""性能基准测试
+
+    python benchmark.py filenames [--count 200000]
+    python benchmark.py collisions [--count 3000]
+
+filenames: 在合成的文件名集合上比较文件名时间解析和分类的新旧实现。
+collisions: 在已有大量同名文件（IMG_0001_1.jpg ...）的目录中查找可用文件名，
+            比较逐个 os.path.exists 和 DirectoryListing。
+"""
+import argparse
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from photo_engine import parse_filename_time, classify_filename, DirectoryListing
+
+
+def legacy_filename_date(filename):
+    """旧版 get_filename_time 的解析逻辑（去掉日志），用于对比"""
+    date_match = re.match(r'(\d{8}).*', filename)
+    if date_match:
+        try:
+            date_str = date_match.group(1)
+            year, month, day = int(date_str[:4]), int(date_str[4:6]), int(date_str[6:8])
+            if 1970 <= year <= 2100 and 1 <= month <= 12 and 1 <= day <= 31:
+                return datetime(year, month, day)
+        except (ValueError, IndexError):
+            pass
+
+    patterns = [
+        r'(\d{4})[-_]?(\d{2})[-_]?(\d{2})',
+        r'(\d{4})(\d{2})(\d{2})_\d{6}',
+        r'IMG_(\d{4})(\d{2})(\d{2})',
+        r'Screenshot_(\d{4})(\d{2})(\d{2})'
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, filename)
+        if match:
+            try:
+                year, month, day = (int(group) for group in match.groups())
+                if 1970 <= year <= 2100 and 1 <= month <= 12 and 1 <= day <= 31:
+                    return datetime(year, month, day)
+            except (ValueError, IndexError):
+                continue
+    return None
+
+
+LEGACY_CATEGORY_PATTERNS = {
+    'screenshots': [r'^screenshot[_-]', r'截图', r'屏幕截图', r'snipaste', r'capture', r'snip',
+                    r'lightshot', r'screen\s*shot', r'截屏', r'快照'],
+    'others': [r'^\d{13}-[a-zA-Z0-9_]+', r'信图片', r'wx_camera', r'mmexport', r'img_[0-9]{13}',
+               r'weixin', r'qq', r'edit', r'modified', r'(copy)', r'副本', r'修改'],
+}
+
+
+def legacy_category(filename):
+    """旧版 _detect_file_category 的文件名匹配部分，用于对比"""
+    filename = filename.lower()
+    for category, pattern_list in LEGACY_CATEGORY_PATTERNS.items():
+        for pattern in pattern_list:
+            if re.search(pattern, filename, re.IGNORECASE):
+                return category
+    return None
+
+
+def synthetic_filenames(count, seed=1):
+    """生成常见相机、手机和聊天软件风格的文件名，约 10% 为同名不同扩展名（实况照片）"""
+    rng = random.Random(seed)
+
+    def date():
+        return datetime(rng.randint(2005, 2024), rng.randint(1, 12), rng.randint(1, 28),
+                        rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+
+    def millis():
+        return str(rng.randint(1_200_000_000_000, 1_720_000_000_000))
+
+    styles = [
+        lambda: f"IMG_{date():%Y%m%d_%H%M%S}.jpg",
+        lambda: f"{date():%Y%m%d_%H%M%S}.jpg",
+        lambda: f"VID_{date():%Y%m%d_%H%M%S}.mp4",
+        lambda: f"Screenshot_{date():%Y-%m-%d-%H-%M-%S}.png",
+        lambda: f"微信图片_{date():%Y%m%d%H%M%S}.jpg",
+        lambda: f"mmexport{millis()}.jpg",
+        lambda: f"wx_camera_{millis()}.jpg",
+        lambda: f"DSC{rng.randint(0, 99999):05d}.JPG",
+        lambda: f"IMG_{rng.randint(0, 9999):04d}.HEIC",
+        lambda: f"{rng.getrandbits(64):016x}.jpg",
+        lambda: f"photo {rng.randint(1, 999)} (copy).jpg",
+        lambda: f"PXL_{date():%Y%m%d_%H%M%S}123.jpg",
+    ]
+    names = []
+    while len(names) < count:
+        name = rng.choice(styles)()
+        names.append(name)
+        if rng.random() < 0.1:
+            names.append(os.path.splitext(name)[0] + '.MOV')
+    return names[:count]
+
+
+def _timed(func, names, repeat=5, setup=None):
+    """取多次运行中最快的一次，减少其他进程造成的波动；setup 在每次运行前调用（如清空缓存）"""
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        results = [func(name) for name in names]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def bench_filenames(count):
+    names = synthetic_filenames(count)
+    stems = [os.path.splitext(name)[0] for name in names]
+    print(f"合成文件名: {len(names)} 个")
+
+    legacy_date_time, legacy_dates = _timed(legacy_filename_date, names)
+    date_time, times = _timed(parse_filename_time, stems, setup=parse_filename_time.cache_clear)
+    # 缓存命中：同一批文件再解析一次（不超过缓存容量）
+    warm_stems = stems[-parse_filename_time.cache_info().maxsize:]
+    warm_date_time, _ = _timed(parse_filename_time, warm_stems)
+
+    legacy_category_time, legacy_categories = _timed(legacy_category, names)
+    category_time, categories = _timed(classify_filename, [stem.lower() for stem in stems],
+                                       setup=classify_filename.cache_clear)
+
+    for label, legacy, new, warm in (
+        ("文件名时间", legacy_date_time, date_time, warm_date_time / len(warm_stems) * len(names)),
+        ("文件名分类", legacy_category_time, category_time, None),
+    ):
+        line = (f"{label}: 旧 {legacy / len(names) * 1e6:.2f} µs/个, "
+                f"新 {new / len(names) * 1e6:.2f} µs/个 ({legacy / new:.1f}x)")
+        if warm is not None:
+            line += f", 缓存命中 {warm / len(names) * 1e6:.2f} µs/个"
+        print(line)
+
+    # 旧实现只解析日期；新实现还解析时刻和时间戳，日期部分应与旧实现一致
+    with_time = sum(1 for result in times if result and result[1])
+    added = sum(1 for old, new in zip(legacy_dates, times) if old is None and new)
+    date_diff = [(name, old, new[0] if new else None)
+                 for name, old, new in zip(names, legacy_dates, times)
+                 if old is not None and (not new or new[0].date() != old.date())]
+    category_diff = sum(old != new for old, new in zip(legacy_categories, categories))
+    print(f"新实现: 带时刻 {with_time} 个, 旧实现无法解析而新实现解析出 {added} 个")
+    print(f"结果不同: 日期 {len(date_diff)} 个, 分类 {category_diff} 个")
+    for name, old, new in date_diff[:5]:
+        print(f"  {name}: 旧 {old}, 新 {new}")
+
+
+def legacy_next_free_path(directory, filename, reserved):
+    """旧版 process_single_file 中查找可用文件名的逻辑"""
+    target_path = os.path.join(directory, filename)
+    base, ext = os.path.splitext(filename)
+    counter = 1
+    while os.path.exists(target_path) or target_path in reserved:
+        target_path = os.path.join(directory, f"{base}_{counter}{ext}")
+        counter += 1
+    return target_path
+
+
+def bench_collisions(count, new_files=500):
+    directory = tempfile.mkdtemp(prefix='photo_bench_')
+    try:
+        for i in range(count + 1):
+            name = "IMG_0001.jpg" if i == 0 else f"IMG_0001_{i}.jpg"
+            open(os.path.join(directory, name), 'wb').close()
+        print(f"目录中已有同名文件: {count + 1} 个，再放入 {new_files} 个 IMG_0001.jpg")
+        
+        reserved = set()
+        start = time.perf_counter()
+        for _ in range(new_files):
+            reserved.add(legacy_next_free_path(directory, "IMG_0001.jpg", reserved))
+        legacy_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        listing = DirectoryListing(directory)
+        names = []
+        for _ in range(new_files):
+            name = listing.next_free_name("IMG_0001.jpg")
+            listing.add(name)
+            names.append(os.path.join(directory, name))
+        listing_time = time.perf_counter() - start
+        
+        assert sorted(names) == sorted(reserved)
+        print(f"逐个 os.path.exists: {legacy_time / new_files * 1e3:.2f} ms/个")
+        print(f"DirectoryListing（含一次 scandir）: {listing_time / new_files * 1e3:.3f} ms/个 "
+              f"({legacy_time / listing_time:.0f}x)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='性能基准测试')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    filenames = subparsers.add_parser('filenames', help='文件名时间解析和分类')
+    filenames.add_argument('--count', type=int, default=200000)
+    collisions = subparsers.add_parser('collisions', help='目标目录中的重名文件处理')
+    collisions.add_argument('--count', type=int, default=3000)
+    args = parser.parse_args()
+
+    if args.benchmark == 'filenames':
+        bench_filenames(args.count)
+    elif args.benchmark == 'collisions':
+        bench_collisions(args.count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3024 @@
+# -*- coding: utf-8 -*-
+"""照片整理引擎
+
+不依赖 Tk 的整理流程：扫描、读取拍摄时间、分类、放置文件、重复检查和相似图片查找。
+图形界面（photo_way.py）和命令行都使用 PhotoOrganizerEngine，命令行用法：
+
+    python photo_engine.py <源目录> <目标目录> [选项]
+"""
+import os
+import errno
+import shutil
+from datetime import datetime
+import re
+from threading import Thread, Lock, Event, Condition
+import queue
+import warnings
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import multiprocessing
+import fnmatch
+import sys
+import argparse
+import time
+import struct
+import sqlite3
+import hashlib
+import json
+from functools import lru_cache, partial
+
+# Pillow 和 NumPy 导入较慢（合计约 0.1 秒），在第一次用到时再导入
+_pil_image = None
+_numpy = False  # False 表示尚未尝试导入
+
+
+def load_pil_image():
+    """按需导入 Pillow 的 Image 模块"""
+    global _pil_image
+    if _pil_image is None:
+        from PIL import Image
+        warnings.filterwarnings("ignore", category=Image.DecompressionBombWarning)
+        _pil_image = Image
+    return _pil_image
+
+
+def load_numpy():
+    """按需导入 NumPy，未安装时返回 None（NumPy 为可选依赖，仅用于加速感知哈希计算）"""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+# 支持的文件类型
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.heic', '.raw', '.cr2', '.nef', '.arw'}
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.avi', '.mkv', '.wmv', '.m4v', '.3gp'}
+SUPPORTED_EXTENSIONS = IMAGE_EXTENSIONS | VIDEO_EXTENSIONS
+
+# 参与相似图片比较的格式
+SIMILAR_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
+
+# 快速 EXIF 读取需要的标签
+EXIF_FAST_TAGS = {
+    256, 257,                # ImageWidth, ImageLength
+    271, 272, 274,           # Make, Model, Orientation
+    306, 36867, 36868,       # DateTime, DateTimeOriginal, DateTimeDigitized
+    40962, 40963,            # PixelXDimension, PixelYDimension
+    34665                    # Exif IFD 指针
+}
+
+# get_file_metadata 返回的字段
+METADATA_FIELDS = ('capture_time', 'make', 'model', 'width', 'height', 'orientation')
+
+# TIFF 字段类型对应的字节数：BYTE, ASCII, SHORT, LONG, UNDEFINED
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 7: 1}
+
+# TIFF 头中的标识：标准 TIFF（包括 CR2、NEF、ARW、DNG）、Panasonic RW2、Olympus ORF
+TIFF_MAGICS = {42, 0x55, 0x4F52}
+
+
+class HeaderBuffer:
+    """按需读取文件头的小窗口，超出当前窗口时才 seek 读取"""
+    def __init__(self, fp, chunk_size=8192):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.start = 0
+        self.data = fp.read(chunk_size)
+
+    def read(self, offset, size):
+        pos = offset - self.start
+        if pos < 0 or pos + size > len(self.data):
+            self.fp.seek(offset)
+            self.data = self.fp.read(max(size, self.chunk_size))
+            self.start = offset
+            pos = 0
+        chunk = self.data[pos:pos + size]
+        if len(chunk) < size:
+            raise ValueError("文件头数据不完整")
+        return chunk
+
+
+def _read_ifd(buf, base, offset, endian):
+    """读取一个 IFD 中需要的标签值"""
+    values = {}
+    count = struct.unpack(endian + 'H', buf.read(base + offset, 2))[0]
+    if count > 1000:
+        raise ValueError(f"IFD 条目数异常: {count}")
+    entries = buf.read(base + offset + 2, count * 12)
+    
+    for i in range(count):
+        tag, field_type, n, raw = struct.unpack(endian + 'HHI4s', entries[i * 12:i * 12 + 12])
+        size = TIFF_TYPE_SIZES.get(field_type)
+        if tag not in EXIF_FAST_TAGS or size is None or n == 0:
+            continue
+            
+        total = size * n
+        if total <= 4:
+            data = raw[:total]
+        elif total <= 256:
+            data = buf.read(base + struct.unpack(endian + 'I', raw)[0], total)
+        else:
+            continue
+            
+        if field_type == 2:
+            values[tag] = data.split(b'\x00', 1)[0].decode('utf-8', 'replace').strip()
+        elif field_type == 3:
+            values[tag] = struct.unpack(endian + 'H', data[:2])[0]
+        elif field_type == 4:
+            values[tag] = struct.unpack(endian + 'I', data[:4])[0]
+    return values
+
+
+def _parse_tiff(buf, base):
+    """解析从 base 处开始的 TIFF 结构，返回 IFD0 和 Exif IFD 中的标签"""
+    byte_order = buf.read(base, 2)
+    if byte_order == b'II':
+        endian = '<'
+    elif byte_order == b'MM':
+        endian = '>'
+    else:
+        return None
+        
+    magic, ifd_offset = struct.unpack(endian + 'HI', buf.read(base + 2, 6))
+    if magic not in TIFF_MAGICS:
+        return None
+        
+    tags = _read_ifd(buf, base, ifd_offset, endian)
+    exif_offset = tags.pop(34665, None)
+    if exif_offset:
+        tags.update(_read_ifd(buf, base, exif_offset, endian))
+    return tags
+
+
+def _parse_exif_datetime(value):
+    """解析 EXIF 日期字符串，失败返回 None"""
+    try:
+        return datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+
+
+def _tags_to_metadata(tags, width=None, height=None):
+    """把 TIFF 标签转换为 get_file_metadata 的元数据结构"""
+    capture_time = None
+    for tag_id in [36867, 36868, 306]:  # DateTimeOriginal, DateTimeDigitized, DateTime
+        if tag_id in tags:
+            capture_time = _parse_exif_datetime(tags[tag_id])
+            if capture_time:
+                break
+                
+    return {
+        'capture_time': capture_time,
+        'make': tags.get(271) or None,
+        'model': tags.get(272) or None,
+        'width': width or tags.get(40962),
+        'height': height or tags.get(40963),
+        'orientation': tags.get(274)
+    }
+
+
+def _read_jpeg(buf):
+    """逐个标记读取 JPEG 的 APP1 EXIF 段和 SOF 中的尺寸，遇到图像数据即停止"""
+    tags = {}
+    width = height = None
+    pos = 2
+    while True:
+        marker = buf.read(pos, 4)
+        if marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xFF:  # 填充字节
+            pos += 1
+            continue
+        if code == 0x01 or 0xD0 <= code <= 0xD8:  # 无长度的标记
+            pos += 2
+            continue
+        if code in (0xD9, 0xDA):  # 图像结束 / 扫描开始
+            break
+            
+        length = struct.unpack('>H', marker[2:4])[0]
+        if code == 0xE1 and not tags and buf.read(pos + 4, 6) == b'Exif\x00\x00':
+            tags = _parse_tiff(buf, pos + 10) or {}
+        elif 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            # SOF 标记中包含图像尺寸
+            height, width = struct.unpack('>HH', buf.read(pos + 5, 4))
+            break
+        pos += 2 + length
+    return _tags_to_metadata(tags, width, height)
+
+
+def _read_tiff(buf):
+    """TIFF 以及基于 TIFF 的 RAW（CR2、NEF、ARW、DNG、RW2、ORF）"""
+    tags = _parse_tiff(buf, 0)
+    if tags is None:
+        return None
+    return _tags_to_metadata(tags, tags.get(40962) or tags.get(256),
+                             tags.get(40963) or tags.get(257))
+
+
+# ISO-BMFF（MP4/MOV/M4V/3GP）中 mvhd 的时间从 1904-01-01 UTC 起算
+MP4_EPOCH_OFFSET = 2082844800
+
+# 文件开头可能出现的顶层 box，用于识别没有 ftyp 的旧 QuickTime 文件
+MP4_TOP_LEVEL_BOXES = {b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'}
+
+# ftyp 中表示 HEIF 图片（而不是视频）的品牌
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'mif1', b'msf1', b'avif'}
+
+# 读取 HEIF meta 子 box（iinf、iloc）的大小上限
+HEIF_BOX_LIMIT = 1024 * 1024
+
+
+def _iter_boxes(fp, start, end, limit=256):
+    """遍历 [start, end) 范围内的 box，只读取 box 头
+    
+    Yields:
+        tuple: (类型, 内容起始位置, box 结束位置)
+    """
+    pos = start
+    for _ in range(limit):
+        if end is not None and pos + 8 > end:
+            return
+        fp.seek(pos)
+        header = fp.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        body = pos + 8
+        if size == 1:  # 64 位长度
+            large = fp.read(8)
+            if len(large) < 8:
+                return
+            size = struct.unpack('>Q', large)[0]
+            body += 8
+        elif size == 0:  # 一直到文件（或父 box）结尾
+            if end is None:
+                fp.seek(0, os.SEEK_END)
+                end = fp.tell()
+            size = end - pos
+        if size < body - pos:
+            return
+        yield box_type, body, pos + size
+        pos += size
+
+
+def _find_box(fp, box_type, start, end):
+    """在 [start, end) 范围内查找第一个指定类型的 box，返回 (内容起始位置, 结束位置)"""
+    for found_type, body, box_end in _iter_boxes(fp, start, end):
+        if found_type == box_type:
+            return body, box_end
+    return None
+
+
+def _read_isobmff_video(buf):
+    """读取 moov/mvhd 中的创建时间，跳过 mdat 时直接 seek，几 GB 的视频也只需几 KB 的读取"""
+    fp = buf.fp
+    moov = _find_box(fp, b'moov', 0, None)
+    mvhd_box = moov and _find_box(fp, b'mvhd', *moov)
+    if not mvhd_box:
+        return None
+    fp.seek(mvhd_box[0])
+    mvhd = fp.read(12)
+    
+    if len(mvhd) < 8:
+        return None
+    if mvhd[0] == 1:
+        if len(mvhd) < 12:
+            return None
+        created = struct.unpack('>Q', mvhd[4:12])[0]
+    else:
+        created = struct.unpack('>I', mvhd[4:8])[0]
+        
+    capture_time = None
+    if created > MP4_EPOCH_OFFSET:  # 0 表示未设置
+        try:
+            capture_time = datetime.fromtimestamp(created - MP4_EPOCH_OFFSET)
+        except (OverflowError, OSError, ValueError):
+            pass
+    metadata = dict.fromkeys(METADATA_FIELDS)
+    metadata['capture_time'] = capture_time
+    return metadata
+
+
+def _read_box_body(fp, body, box_end):
+    size = box_end - body
+    if size > HEIF_BOX_LIMIT:
+        raise ValueError(f"box 过大: {size}")
+    fp.seek(body)
+    data = fp.read(size)
+    if len(data) < size:
+        raise ValueError("box 数据不完整")
+    return data
+
+
+def _heif_exif_item(iinf):
+    """在 iinf 中查找类型为 Exif 的条目编号"""
+    version = iinf[0]
+    pos = 6 if version == 0 else 8
+    while pos + 8 <= len(iinf):
+        size, box_type = struct.unpack('>I4s', iinf[pos:pos + 8])
+        if size < 8:
+            return None
+        if box_type == b'infe':
+            infe_version = iinf[pos + 8]
+            if infe_version >= 2:
+                if infe_version == 2:
+                    item_id, item_type = struct.unpack('>H2x4s', iinf[pos + 12:pos + 20])
+                else:
+                    item_id, item_type = struct.unpack('>I2x4s', iinf[pos + 12:pos + 22])
+                if item_type == b'Exif':
+                    return item_id
+        pos += size
+    return None
+
+
+def _heif_item_offset(iloc, wanted_id):
+    """在 iloc 中查找条目在文件中的偏移（只支持直接存放在文件中的条目）"""
+    def uint(pos, size):
+        if size == 0:
+            return 0, pos
+        return int.from_bytes(iloc[pos:pos + size], 'big'), pos + size
+        
+    version = iloc[0]
+    offset_size, length_size = iloc[4] >> 4, iloc[4] & 0x0F
+    base_offset_size, index_size = iloc[5] >> 4, (iloc[5] & 0x0F if version in (1, 2) else 0)
+    item_count, pos = uint(6, 2 if version < 2 else 4)
+    
+    for _ in range(item_count):
+        item_id, pos = uint(pos, 2 if version < 2 else 4)
+        construction_method = 0
+        if version in (1, 2):
+            method, pos = uint(pos, 2)
+            construction_method = method & 0x0F
+        pos += 2  # data_reference_index
+        base_offset, pos = uint(pos, base_offset_size)
+        extent_count, pos = uint(pos, 2)
+        first_offset = None
+        for _ in range(extent_count):
+            pos += index_size
+            extent_offset, pos = uint(pos, offset_size)
+            pos += length_size
+            if first_offset is None:
+                first_offset = extent_offset
+        if item_id == wanted_id:
+            if construction_method != 0 or first_offset is None:
+                return None
+            return base_offset + first_offset
+        if pos > len(iloc):
+            break
+    return None
+
+
+def _read_heif(buf):
+    """HEIC/HEIF：通过 meta 中的 iinf/iloc 找到 Exif 条目，再按 TIFF 解析"""
+    fp = buf.fp
+    meta = _find_box(fp, b'meta', 0, None)
+    if not meta:
+        return None
+    # meta 是 FullBox，子 box 从版本和标志之后开始
+    iinf_box = _find_box(fp, b'iinf', meta[0] + 4, meta[1])
+    iloc_box = _find_box(fp, b'iloc', meta[0] + 4, meta[1])
+    if not (iinf_box and iloc_box):
+        return None
+    item_id = _heif_exif_item(_read_box_body(fp, *iinf_box))
+    if item_id is None:
+        return None
+    offset = _heif_item_offset(_read_box_body(fp, *iloc_box), item_id)
+    if offset is None:
+        return None
+    # Exif 条目以 4 字节的 TIFF 头偏移开始（通常跳过 "Exif\0\0"）
+    tiff_offset = struct.unpack('>I', buf.read(offset, 4))[0]
+    tags = _parse_tiff(buf, offset + 4 + tiff_offset)
+    if tags is None:
+        return None
+    return _tags_to_metadata(tags)
+
+
+def _read_with_pillow(buf):
+    """PNG、GIF、BMP 交给 Pillow 读取尺寸和 EXIF"""
+    Image = load_pil_image()
+    buf.fp.seek(0)
+    with Image.open(buf.fp) as img:
+        width, height = img.size
+        exif = img._getexif() if hasattr(img, '_getexif') else None
+    return _tags_to_metadata(exif or {}, width, height)
+
+
+# 文件头特征 -> 格式，ISO-BMFF 另按 ftyp 品牌区分图片和视频
+FILE_SIGNATURES = [
+    (b'\xff\xd8', 'jpeg'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+    (b'IIU\x00', 'tiff'),   # Panasonic RW2
+    (b'IIRO', 'tiff'),      # Olympus ORF
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+]
+
+# 格式 -> 元数据读取函数；不在表中的格式（AVI、MKV、WMV、未知 RAW 等）不读取元数据
+METADATA_READERS = {
+    'jpeg': _read_jpeg,
+    'tiff': _read_tiff,
+    'heif': _read_heif,
+    'video': _read_isobmff_video,
+    'png': _read_with_pillow,
+    'gif': _read_with_pillow,
+    'bmp': _read_with_pillow,
+}
+
+
+def detect_file_format(head, ext=''):
+    """根据文件开头的字节（至少 12 字节）和扩展名判断格式，无法识别时返回 None"""
+    for signature, file_format in FILE_SIGNATURES:
+        if head.startswith(signature):
+            return file_format
+    if head[4:8] in MP4_TOP_LEVEL_BOXES:
+        if head[4:8] == b'ftyp' and head[8:12] in HEIF_BRANDS:
+            return 'heif'
+        if ext in ('.heic', '.heif'):
+            return 'heif'
+        return 'video'
+    return None
+
+
+# 文件头解析失败（结构不标准、厂商私有扩展等）时再交给 Pillow 读取的格式
+PILLOW_FALLBACK_FORMATS = {'jpeg', 'tiff'}
+
+
+def _parse_metadata(reader, buf):
+    """调用元数据读取函数，文件内容无法解析时返回 None
+    
+    读取文件本身出错（权限不足、网络存储超时等，OSError 带有 errno）时继续抛出；
+    Pillow 无法识别图片时抛出的 OSError 没有 errno，按无法解析处理。
+    """
+    try:
+        return reader(buf)
+    except OSError as e:
+        if e.errno is not None:
+            raise
+        return None
+    except Exception:
+        return None
+
+
+def read_file_metadata(file_path):
+    """按文件格式选择读取方式，读取拍摄时间、制造商、型号、尺寸和方向
+    
+    JPEG、TIFF/RAW、HEIC 和 MP4/MOV 直接解析文件头，只读取几 KB，JPEG、TIFF
+    解析失败时再交给 Pillow；PNG/GIF/BMP 交给 Pillow；其他格式不打开解析。
+    
+    Returns:
+        tuple: (格式, 元数据)，无法读取的字段为 None，格式无法识别时为 None
+        
+    Raises:
+        OSError: 文件无法打开或读取，此时不能认为文件没有元数据
+    """
+    metadata = dict.fromkeys(METADATA_FIELDS)
+    with open(file_path, 'rb') as fp:
+        buf = HeaderBuffer(fp)
+        file_format = detect_file_format(buf.data[:16], os.path.splitext(file_path)[1].lower())
+        reader = METADATA_READERS.get(file_format)
+        if reader is None:
+            return file_format, metadata
+        result = _parse_metadata(reader, buf)
+        if result is None and file_format in PILLOW_FALLBACK_FORMATS:
+            result = _parse_metadata(_read_with_pillow, buf)
+    return file_format, result or metadata
+
+
+# 文件名中的时间，各种格式合并为一个正则，一次扫描：
+#   ms:  以 1 开头的 13 位毫秒时间戳（2001-2033 年），例如 mmexport1684000000000、wx_camera_1684000000000
+#   s:   10 位秒级时间戳很容易与普通编号混淆（如 photo_1234567890、QQ_1357924680），
+#        只接受已知会用秒级时间戳命名的前缀，例如 mmexport1684000000、wx_camera_1684000000
+#   日期和可选的时刻：YYYYMMDD、YYYY-MM-DD、YYYY_MM_DD，以及 IMG_20230512_143022、
+#        PXL_20230512_143022123、微信图片_20230512143022、Screenshot_2023-05-12-14-30-22、
+#        2023-05-12 14.30.22、Screenshot 2023-05-12 at 14.30.22
+# 数字只从一串数字的开头匹配，避免从毫秒时间戳等长数字的中间取出日期
+# 开头的 (?=\d) 让正则引擎直接跳到数字处开始尝试，前缀用后顾断言判断
+FILENAME_TIME_RE = re.compile(
+    r'(?=\d)(?<!\d)(?:'
+    r'(?P<ms>1\d{12})(?!\d)'
+    r'|(?:(?<=(?i:mmexport))|(?<=(?i:wx_camera_))|(?<=(?i:micromsg\.)))(?P<s>1\d{9})(?!\d)'
+    r'|(?P<year>\d{4})[-_]?(?P<month>\d{2})[-_]?(?P<day>\d{2})'
+    r'(?:(?:[-_ T]|\s+at\s+)?(?P<hour>\d{2})[-_.:]?(?P<minute>\d{2})[-_.:]?(?P<second>\d{2}))?)')
+
+# 文件名分类关键词（匹配小写的文件名），每个分类合并为一个正则，按字典顺序检查
+CATEGORY_PATTERNS = {
+    'screenshots': [
+        r'^screenshot[_-]',      # Screenshot开头
+        r'截图',
+        r'屏幕截图',
+        r'snipaste',
+        r'capture',
+        r'snip',
+        r'lightshot',
+        r'screen\s*shot',
+        r'截屏',
+        r'快照',
+    ],
+    'others': [
+        r'^\d{13}-[a-zA-Z0-9_]+',
+        r'信图片',
+        r'wx_camera',
+        r'mmexport',
+        r'img_[0-9]{13}',
+        r'weixin',
+        r'qq',
+        r'edit',
+        r'modified',
+        r'(copy)',
+        r'副本',
+        r'修改',
+    ]
+}
+CATEGORY_RES = [(category, re.compile('|'.join(patterns)))
+                for category, patterns in CATEGORY_PATTERNS.items()]
+
+
+FILENAME_DATE_GROUPS = ('year', 'month', 'day')
+FILENAME_DATETIME_GROUPS = FILENAME_DATE_GROUPS + ('hour', 'minute', 'second')
+
+
+@lru_cache(maxsize=65536)
+def parse_filename_time(stem):
+    """从文件名（不含扩展名）中解析拍摄时间
+    
+    同一文件名中有多个时间时按优先级取：日期和时刻、毫秒时间戳、秒级时间戳、只有日期。
+    
+    Returns:
+        tuple: (datetime, 是否包含时刻)，年份不在 1970-2100 之间或无法解析时返回 None
+    """
+    best = None  # (优先级, datetime)
+    pos = 0
+    while True:
+        match = FILENAME_TIME_RE.search(stem, pos)
+        if match is None:
+            break
+        kind = match.lastgroup
+        try:
+            if kind == 'second':
+                try:
+                    result = datetime(*map(int, match.group(*FILENAME_DATETIME_GROUPS)))
+                    if 1970 <= result.year <= 2100:
+                        return result, True
+                except ValueError:  # 例如 25点，只取日期
+                    pass
+                priority, result = 3, datetime(*map(int, match.group(*FILENAME_DATE_GROUPS)))
+            elif kind == 'day':
+                priority, result = 3, datetime(*map(int, match.group(*FILENAME_DATE_GROUPS)))
+            elif kind == 'ms':
+                priority, result = 1, datetime.fromtimestamp(int(match['ms']) / 1000)
+            else:
+                priority, result = 2, datetime.fromtimestamp(int(match['s']))
+        except (ValueError, OverflowError, OSError):  # 例如 2月30日
+            result = None
+            
+        if result is None or not 1970 <= result.year <= 2100:
+            # 无效时从下一个字符重新查找，不跳过匹配范围内的其他日期
+            pos = match.start() + 1
+            continue
+        if best is None or priority < best[0]:
+            best = priority, result
+        pos = match.end()
+    return (best[1], best[0] != 3) if best else None
+
+
+@lru_cache(maxsize=65536)
+def classify_filename(stem):
+    """根据小写的文件名（不含扩展名）判断分类，没有匹配的关键词时返回 None"""
+    for category, pattern in CATEGORY_RES:
+        if pattern.search(stem):
+            return category
+    return None
+
+
+# 没有零拷贝路径时每次读写的缓冲区大小，可通过 PhotoOrganizerEngine.copy_buffer_size 调整
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# 不小于该大小的文件复制前预分配目标空间，减少碎片和逐块扩展文件的元数据更新
+COPY_PREALLOCATE_MIN = 4 * 1024 * 1024
+
+# 这些错误表示当前文件系统或平台不支持该复制方式，换用下一种方式继续
+COPY_FALLBACK_ERRNOS = {
+    errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP,
+    getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP), errno.ENOTSOCK, errno.EBADF, errno.ETXTBSY
+}
+
+
+def _copy_range(src_fd, dst_fd, offset, buffer_size):
+    """copy_file_range：数据不经过用户空间，部分文件系统在服务端或存储端直接完成"""
+    while True:
+        sent = os.copy_file_range(src_fd, dst_fd, 1 << 30, offset, offset)
+        if sent == 0:
+            return
+        offset += sent
+        yield offset
+
+
+def _copy_sendfile(src_fd, dst_fd, offset, buffer_size):
+    """sendfile：数据不经过用户空间（Linux 2.6.33 起支持普通文件作为目标）"""
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while True:
+        sent = os.sendfile(dst_fd, src_fd, offset, 1 << 30)
+        if sent == 0:
+            return
+        offset += sent
+        yield offset
+
+
+def _copy_buffered(src_fd, dst_fd, offset, buffer_size, hasher=None):
+    """使用大缓冲区读写，适用于所有平台；提供 hasher 时同时计算读到的数据的摘要"""
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(src_fd, 'rb', buffering=0, closefd=False) as src:
+        while True:
+            n = src.readinto(buffer)
+            if not n:
+                return
+            if hasher is not None:
+                hasher.update(view[:n])
+            written = 0
+            while written < n:
+                written += os.write(dst_fd, view[written:n])
+            offset += n
+            yield offset
+
+
+# 按顺序尝试的复制方式，零拷贝方式只在 Linux 上可用于普通文件。
+# 每种方式都是生成器，每复制一段产生当前位置，换用下一种方式时从该位置继续
+COPY_METHODS = [_copy_buffered]
+if sys.platform.startswith('linux'):
+    if hasattr(os, 'sendfile'):
+        COPY_METHODS.insert(0, _copy_sendfile)
+    if hasattr(os, 'copy_file_range'):
+        COPY_METHODS.insert(0, _copy_range)
+
+
+def copy_file(src, dst, buffer_size=COPY_BUFFER_SIZE, preallocate=True, hasher=None, fsync=False):
+    """复制文件内容和元数据（与 shutil.copy2 相同），返回复制的字节数
+    
+    依次尝试 copy_file_range、sendfile 和大缓冲区读写。某种方式不被支持，
+    或在源文件末尾之前就停止（部分 FUSE、虚拟文件系统和旧内核返回 0）时，
+    从已复制的位置换用下一种方式继续。复制失败时删除不完整的目标文件。
+    
+    Args:
+        hasher: hashlib 对象，提供时用缓冲区读写，复制的同时计算源数据摘要（不需要再读一遍）
+        fsync (bool): 返回前将目标文件数据写入磁盘
+        
+    Raises:
+        OSError: 复制失败，或复制的数据少于源文件大小而源文件并没有变小
+    """
+    methods = [partial(_copy_buffered, hasher=hasher)] if hasher is not None else COPY_METHODS
+    with open(src, 'rb') as src_fp:
+        src_fd = src_fp.fileno()
+        size = os.fstat(src_fd).st_size
+        with open(dst, 'wb') as dst_fp:
+            dst_fd = dst_fp.fileno()
+            try:
+                if preallocate and size >= COPY_PREALLOCATE_MIN and hasattr(os, 'posix_fallocate'):
+                    try:
+                        os.posix_fallocate(dst_fd, 0, size)
+                    except OSError:
+                        pass  # 文件系统不支持时直接复制
+                        
+                copied = 0
+                for method in methods:
+                    try:
+                        for copied in method(src_fd, dst_fd, copied, buffer_size):
+                            pass
+                    except OSError as e:
+                        if e.errno not in COPY_FALLBACK_ERRNOS or method is methods[-1]:
+                            raise
+                    if copied >= size:
+                        break
+                        
+                if copied != size:
+                    # 只有源文件在复制过程中确实变小时才截掉预分配的多余部分
+                    if os.fstat(src_fd).st_size != copied:
+                        raise OSError(errno.EIO, f"复制不完整: {copied}/{size} 字节", src)
+                    os.ftruncate(dst_fd, copied)
+                if fsync:
+                    os.fsync(dst_fd)
+            except BaseException:
+                dst_fp.close()
+                try:
+                    os.remove(dst)
+                except OSError:
+                    pass
+                raise
+    shutil.copystat(src, dst)
+    return copied
+
+
+# 复制（包括跨磁盘移动和 reflink）先写入带该后缀的临时文件，完成后再改为目标文件名，
+# 中断时图库中不会留下不完整的文件
+PARTIAL_SUFFIX = '.part'
+
+# 跨磁盘移动时所有线程同时在复制的数据量上限，控制内存和磁盘队列压力
+MOVE_INFLIGHT_BYTES = 256 * 1024 * 1024
+
+# 跨磁盘移动校验通过的源文件累积到该数量后批量删除
+MOVE_UNLINK_BATCH = 64
+
+
+class ByteBudget:
+    """限制多个线程同时占用的字节数
+    
+    超过上限的单个请求在没有其他占用时也允许通过，避免大文件永远等待。
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._cond = Condition()
+
+    def acquire(self, size):
+        with self._cond:
+            while self.in_use and self.in_use + size > self.limit:
+                self._cond.wait()
+            self.in_use += size
+
+    def release(self, size):
+        with self._cond:
+            self.in_use -= size
+            self._cond.notify_all()
+
+
+# Linux 的 FICLONE ioctl：在 btrfs、XFS 等文件系统上创建写时复制的副本
+FICLONE = 0x40049409
+
+# 这些错误表示源和目标不在同一文件系统，或文件系统不支持链接，改为复制
+LINK_FALLBACK_ERRNOS = {
+    errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP),
+    errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EMLINK
+}
+
+
+def reflink_file(src, dst):
+    """创建共享数据块的写时复制副本（FICLONE），并复制元数据
+    
+    不支持时抛出 OSError（跨文件系统为 EXDEV，文件系统不支持为 EOPNOTSUPP 等），
+    不会留下目标文件。
+    """
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "当前平台不支持 reflink")
+    with open(src, 'rb') as src_fp:
+        with open(dst, 'wb') as dst_fp:
+            try:
+                fcntl.ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+            except BaseException:
+                dst_fp.close()
+                os.remove(dst)
+                raise
+    shutil.copystat(src, dst)
+
+
+def partial_digest(file_path, size, sample_size=64 * 1024):
+    """读取文件开头和结尾各一段计算摘要，用于快速排除内容不同的文件"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        h.update(f.read(sample_size))
+        if size > sample_size * 2:
+            f.seek(size - sample_size)
+        h.update(f.read(sample_size))
+    return h.hexdigest()
+
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """流式读取完整文件内容计算 BLAKE2b 摘要"""
+    h = hashlib.blake2b()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def dhash(file_path, hash_size=8):
+    """计算图片的差值感知哈希（dHash）
+    
+    利用 Pillow 的 draft() 让 JPEG 解码器直接输出缩小的灰度图，
+    不需要解码完整分辨率。安装了 NumPy 时用向量化计算比较相邻像素。
+    
+    Returns:
+        int: hash_size * hash_size 位的哈希值
+    """
+    Image = load_pil_image()
+    np = load_numpy()
+    with Image.open(file_path) as img:
+        img.draft('L', ((hash_size + 1) * 4, hash_size * 4))
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+        
+    if np is not None:
+        pixels = np.asarray(small, dtype=np.int16)
+        bits = pixels[:, 1:] > pixels[:, :-1]
+        return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+        
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col + 1] > pixels[offset + col])
+    return value
+
+
+def hamming_distance(a, b):
+    """两个哈希值之间不同的位数"""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树，用于查找相近的感知哈希
+    
+    查询时利用三角不等式剪枝，只访问距离范围内的子树。
+    """
+    def __init__(self):
+        self.root = None  # [hash, items, {distance: child}]
+        self.size = 0
+
+    def add(self, value, item):
+        """加入一个哈希值及其对应的文件"""
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """查找距离不超过 max_distance 的文件 -> [(distance, item)]"""
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+class MetadataCache:
+    """持久化的文件元数据缓存（SQLite）
+    
+    以 (路径, 大小, 修改时间) 识别文件，大小或修改时间变化后旧记录自动失效。
+    写入先累积在内存中，达到一定数量后批量提交；记录数超过上限时
+    按最近使用时间淘汰。
+    """
+    FIELDS = ('capture_time', 'time_methods', 'category', 'digest', 'phash', 'exif_time')
+
+    def __init__(self, db_path, max_entries=1000000, flush_every=500):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self._lock = Lock()
+        self._pending = {}
+        self._touched = []
+        
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_cache ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "capture_time TEXT, time_methods TEXT, category TEXT, digest TEXT, "
+            "last_used REAL NOT NULL)"
+        )
+        # 旧版本数据库补充新增的字段
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(file_cache)")}
+        for field in self.FIELDS:
+            if field not in columns:
+                self._conn.execute(f"ALTER TABLE file_cache ADD COLUMN {field} TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_file_cache_last_used ON file_cache(last_used)")
+        self._conn.commit()
+        self._approx_count = self._conn.execute("SELECT COUNT(*) FROM file_cache").fetchone()[0]
+
+    def get(self, path, size, mtime_ns):
+        """查询缓存记录，文件已变化或不存在时返回 None"""
+        with self._lock:
+            entry = self._pending.get(path)
+            if entry is None:
+                row = self._conn.execute(
+                    f"SELECT size, mtime_ns, {', '.join(self.FIELDS)} "
+                    "FROM file_cache WHERE path = ?", (path,)
+                ).fetchone()
+                if row is None:
+                    return None
+                entry = dict(zip(('size', 'mtime_ns') + self.FIELDS, row))
+                # 只读取缓存的重复整理也要定期写回使用时间，不让待更新列表无限增长
+                self._touched.append((time.time(), path))
+                if len(self._touched) >= self.flush_every:
+                    self._flush_locked()
+            if entry['size'] != size or entry['mtime_ns'] != mtime_ns:
+                return None
+            return {field: entry[field] for field in self.FIELDS}
+
+    def put(self, path, size, mtime_ns, **fields):
+        """写入或更新缓存记录，未提供的字段沿用同一文件版本的旧值"""
+        with self._lock:
+            entry = self._pending.get(path)
+            if entry is None or entry['size'] != size or entry['mtime_ns'] != mtime_ns:
+                entry = {'size': size, 'mtime_ns': mtime_ns}
+                entry.update(dict.fromkeys(self.FIELDS))
+                self._pending[path] = entry
+            entry.update((k, v) for k, v in fields.items() if k in self.FIELDS)
+            
+            if len(self._pending) >= self.flush_every:
+                self._flush_locked()
+
+    def flush(self):
+        """提交尚未写入的记录"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._pending:
+            now = time.time()
+            rows = [
+                (path, e['size'], e['mtime_ns']) + tuple(e[field] for field in self.FIELDS) + (now,)
+                for path, e in self._pending.items()
+            ]
+            # 与库中同一文件版本的旧值合并，文件变化时整条替换
+            same_version = "size = excluded.size AND mtime_ns = excluded.mtime_ns"
+            updates = ", ".join(
+                f"{field} = CASE WHEN {same_version} "
+                f"THEN COALESCE(excluded.{field}, {field}) ELSE excluded.{field} END"
+                for field in self.FIELDS
+            )
+            self._conn.executemany(
+                f"INSERT INTO file_cache (path, size, mtime_ns, {', '.join(self.FIELDS)}, last_used) "
+                f"VALUES ({', '.join('?' * (len(self.FIELDS) + 4))}) "
+                f"ON CONFLICT(path) DO UPDATE SET {updates}, "
+                "size = excluded.size, mtime_ns = excluded.mtime_ns, last_used = excluded.last_used",
+                rows
+            )
+            self._approx_count += len(rows)
+            self._pending.clear()
+            
+        if self._touched:
+            self._conn.executemany("UPDATE file_cache SET last_used = ? WHERE path = ?", self._touched)
+            self._touched.clear()
+            
+        self._conn.commit()
+        
+        if self._approx_count > self.max_entries:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        """超过上限时删除最久未使用的记录，额外腾出 10% 空间"""
+        count = self._conn.execute("SELECT COUNT(*) FROM file_cache").fetchone()[0]
+        if count > self.max_entries:
+            excess = count - self.max_entries + self.max_entries // 10
+            self._conn.execute(
+                "DELETE FROM file_cache WHERE path IN "
+                "(SELECT path FROM file_cache ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self._conn.commit()
+            count -= excess
+        self._approx_count = count
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._pending.clear()
+            self._touched.clear()
+            self._conn.execute("DELETE FROM file_cache")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+            self._approx_count = 0
+
+    def close(self):
+        """提交并关闭数据库"""
+        with self._lock:
+            self._flush_locked()
+            self._conn.close()
+
+
+class LibraryIndex:
+    """目标图库的内容索引（SQLite），记录每个文件的路径、大小、修改时间和摘要
+    
+    摘要按需补全：只有出现相同大小的文件时才需要计算，因此建立索引
+    只需要一次目录遍历。写操作先保存在内存中批量提交，查询时合并未提交的记录。
+    """
+    def __init__(self, db_path, flush_every=500):
+        self.db_path = db_path
+        self.flush_every = flush_every
+        self._lock = Lock()
+        self._pending = {}  # {path: (root, size, mtime_ns, digest)}，None 表示删除
+        
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS library_files ("
+            "path TEXT PRIMARY KEY, root TEXT NOT NULL, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, digest TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_library_size ON library_files(root, size)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS library_roots (root TEXT PRIMARY KEY, built_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def add(self, root, path, size, mtime_ns, digest=None):
+        """添加或更新文件记录"""
+        self._queue(path, (root, size, mtime_ns, digest))
+
+    def remove(self, path):
+        """删除文件记录"""
+        self._queue(path, None)
+
+    def find_by_size(self, root, size):
+        """查询图库中指定大小的文件 -> [(path, mtime_ns, digest)]"""
+        with self._lock:
+            rows = [
+                row for row in self._conn.execute(
+                    "SELECT path, mtime_ns, digest FROM library_files WHERE root = ? AND size = ?",
+                    (root, size)
+                ).fetchall()
+                if row[0] not in self._pending
+            ]
+            for path, entry in self._pending.items():
+                if entry is not None and entry[0] == root and entry[1] == size:
+                    rows.append((path, entry[2], entry[3]))
+            return rows
+
+    def is_built(self, root):
+        """图库是否已完整建立过索引"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM library_roots WHERE root = ?", (root,)
+            ).fetchone() is not None
+
+    def mark_built(self, root):
+        """标记图库索引已完整建立"""
+        with self._lock:
+            self._flush_locked()
+            self._conn.execute("INSERT OR REPLACE INTO library_roots (root, built_at) VALUES (?, ?)",
+                               (root, time.time()))
+            self._conn.commit()
+
+    def _queue(self, path, entry):
+        with self._lock:
+            self._pending[path] = entry
+            if len(self._pending) >= self.flush_every:
+                self._flush_locked()
+
+    def flush(self):
+        """提交尚未写入的操作"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._pending:
+            self._conn.executemany(
+                "DELETE FROM library_files WHERE path = ?",
+                [(path,) for path, entry in self._pending.items() if entry is None]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO library_files (path, root, size, mtime_ns, digest) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(path,) + entry for path, entry in self._pending.items() if entry is not None]
+            )
+            self._conn.commit()
+            self._pending.clear()
+
+    def clear(self):
+        """清空索引"""
+        with self._lock:
+            self._pending.clear()
+            self._conn.execute("DELETE FROM library_files")
+            self._conn.execute("DELETE FROM library_roots")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+    def close(self):
+        """提交并关闭数据库"""
+        with self._lock:
+            self._flush_locked()
+            self._conn.close()
+
+
+class OperationJournal:
+    """只追加的文件操作日志，用于程序关闭或崩溃后从中断处继续整理
+    
+    每个文件依次写入记录：P（已确定目标路径）、S（开始移动/复制），最后是 C（完成）或 F（失败）。
+    每条记录立即写入操作系统，程序崩溃也不会丢失；每 fsync_every 条完成记录同步一次磁盘。
+    整理正常结束后删除日志文件，只有中断的整理会留下日志。
+    """
+    VERSION = 1
+
+    def __init__(self, path, settings, fsync_every=500):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._lock = Lock()
+        self._next_id = 0
+        self._commits_since_sync = 0
+        self.entries = {}  # 上次运行的记录 {源路径: (状态, 目标路径, 操作编号)}
+        
+        header = ["H", self.VERSION, settings]
+        if os.path.exists(path):
+            matches = self._load(header)
+            # 日志在整理开始前打开，此时删除上次留下的临时文件不会与本次的复制冲突
+            self._remove_partials()
+            if not matches:
+                # 选项不同或日志损坏时不能继续，重新开始
+                self.entries.clear()
+                self._next_id = 0
+                os.remove(path)
+        is_new = not os.path.exists(path)
+        self._fp = open(path, 'a', encoding='utf-8', newline='\n', buffering=1)
+        if is_new:
+            self._write(header)
+
+    def _load(self, header):
+        """读取上次运行的记录，返回日志头是否与当前选项一致
+        
+        不一致时也读取全部记录，用于清理上次留下的临时文件。
+        """
+        ids = {}
+        matches = False
+        with open(self.path, 'r', encoding='utf-8') as fp:
+            for line_number, line in enumerate(fp):
+                try:
+                    record = json.loads(line)
+                    if line_number == 0:
+                        matches = record == header
+                        continue
+                    kind, op_id = record[0], record[1]
+                    if kind == "P":
+                        ids[op_id] = record[2]
+                        self.entries[record[2]] = (kind, record[3], op_id)
+                    elif op_id in ids:
+                        self.entries[ids[op_id]] = (kind,) + self.entries[ids[op_id]][1:]
+                    self._next_id = max(self._next_id, op_id + 1)
+                except (ValueError, TypeError, IndexError):
+                    break  # 崩溃时最后一行可能不完整
+        return matches
+
+    def _remove_partials(self):
+        """删除上次运行中已开始但没有完成（停在 S）的操作留下的临时文件"""
+        for state, target_path, _ in self.entries.values():
+            if state != "S":
+                continue
+            try:
+                os.remove(target_path + PARTIAL_SUFFIX)
+            except OSError:
+                pass  # 没有留下临时文件，或已被删除
+
+    def _write(self, record):
+        self._fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def lookup(self, src):
+        """上次运行中该源文件的 (状态, 目标路径, 操作编号)，没有记录时返回 None"""
+        return self.entries.get(src)
+
+    def is_committed(self, src):
+        entry = self.entries.get(src)
+        return entry is not None and entry[0] == "C"
+
+    def planned(self, src, dst):
+        """记录已确定的目标路径，返回操作编号"""
+        with self._lock:
+            op_id = self._next_id
+            self._next_id += 1
+            self._write(["P", op_id, src, dst])
+        return op_id
+
+    def started(self, op_id):
+        with self._lock:
+            self._write(["S", op_id])
+
+    def failed(self, op_id):
+        """记录放置失败，下次运行不再把该目标路径当作未完成的操作"""
+        with self._lock:
+            self._write(["F", op_id])
+
+    def committed(self, op_id):
+        with self._lock:
+            self._write(["C", op_id])
+            self._commits_since_sync += 1
+            if self._commits_since_sync >= self.fsync_every:
+                os.fsync(self._fp.fileno())
+                self._commits_since_sync = 0
+
+    def close(self, completed):
+        """关闭日志；completed 为 True 时整理已全部完成，删除日志文件"""
+        with self._lock:
+            if self._fp.closed:
+                return
+            if not completed:
+                self._fp.flush()
+                os.fsync(self._fp.fileno())
+            self._fp.close()
+        if completed:
+            os.remove(self.path)
+
+
+class DirectoryListing:
+    """目标目录中已存在或已预留的文件名，用 os.scandir 读取一次后在内存中维护
+    
+    判断文件名是否已被占用和查找下一个可用序号都不需要访问磁盘。
+    调用方需持有该目录的锁；在大小写不敏感的系统上忽略大小写比较。
+    """
+    CASE_INSENSITIVE = sys.platform in ('win32', 'darwin')
+
+    def __init__(self, path):
+        self.path = path
+        self._names = set()
+        self._next_suffix = {}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                self._names.add(self._key(entry.name))
+
+    def _key(self, name):
+        return name.casefold() if self.CASE_INSENSITIVE else name
+
+    def __contains__(self, name):
+        return self._key(name) in self._names
+
+    def add(self, name):
+        self._names.add(self._key(name))
+
+    def discard(self, name):
+        self._names.discard(self._key(name))
+
+    def next_free_name(self, filename):
+        """返回 "名称_序号.扩展名" 形式的第一个未占用的文件名
+        
+        记住每个文件名上次分配的序号，同名文件很多时不必每次从 1 开始查找。
+        """
+        base, ext = os.path.splitext(filename)
+        key = self._key(filename)
+        counter = self._next_suffix.get(key, 1)
+        while self._key(f"{base}_{counter}{ext}") in self._names:
+            counter += 1
+        self._next_suffix[key] = counter + 1
+        return f"{base}_{counter}{ext}"
+
+
+class ProgressTracker:
+    """整理进度计数器
+    
+    工作线程只在锁内累加计数，界面按固定频率调用 snapshot() 取样，
+    每次取样合并为一次状态更新，界面刷新次数与处理速度无关。
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        """清空进度，没有进行中的阶段"""
+        with self._lock:
+            self.stage = None
+            self.done = 0
+            self.bytes = 0
+            self.total = 0
+            self.total_final = True
+            self._started_at = 0
+            self._finished_at = None
+
+    def start_stage(self, stage, total=0, total_final=True):
+        """开始新的阶段，计数从零开始
+        
+        Args:
+            stage (str): 显示在状态栏中的阶段名称
+            total (int): 文件总数
+            total_final (bool): 总数是否已确定，扫描未结束时为 False
+        """
+        with self._lock:
+            self.stage = stage
+            self.done = 0
+            self.bytes = 0
+            self.total = total
+            self.total_final = total_final
+            self._started_at = time.perf_counter()
+            self._finished_at = None
+
+    def set_total(self, total, final=False):
+        """更新文件总数（扫描线程调用）"""
+        with self._lock:
+            self.total = total
+            self.total_final = final
+
+    def add(self, files=1, nbytes=0):
+        """累加已完成的文件数和字节数"""
+        with self._lock:
+            self.done += files
+            self.bytes += nbytes
+
+    def finish(self):
+        """结束当前阶段，速度按阶段耗时固定下来"""
+        with self._lock:
+            if self.stage is not None and self._finished_at is None:
+                self._finished_at = time.perf_counter()
+
+    def snapshot(self):
+        """取样当前进度
+        
+        Returns:
+            dict: stage, done, total, percent, files_per_sec, bytes_per_sec, status；
+                  没有进行中的阶段时返回 None
+        """
+        with self._lock:
+            if self.stage is None:
+                return None
+            end = self._finished_at if self._finished_at is not None else time.perf_counter()
+            elapsed = max(end - self._started_at, 1e-6)
+            done, nbytes, total, total_final = self.done, self.bytes, self.total, self.total_final
+            stage = self.stage
+        
+        files_per_sec = done / elapsed
+        bytes_per_sec = nbytes / elapsed
+        if total_final:
+            status = f"{stage}: {done}/{total}"
+        else:
+            status = f"{stage}: {done}/已找到 {total} (扫描中...)"
+        status += f" ({files_per_sec:.0f} 文件/秒, {bytes_per_sec / (1024 * 1024):.1f} MB/s)"
+        return {
+            'stage': stage,
+            'done': done,
+            'total': total,
+            'percent': min(done / max(total, 1) * 100, 100),
+            'files_per_sec': files_per_sec,
+            'bytes_per_sec': bytes_per_sec,
+            'status': status,
+        }
+
+
+# 逐个文件日志可选的级别
+FILE_LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+
+def start_queue_logging(handlers, level=logging.INFO):
+    """通过 QueueHandler/QueueListener 输出日志
+    
+    记录日志的线程只把记录放入队列，写文件和控制台由监听线程完成，
+    处理线程不会因为磁盘或控制台输出而阻塞。程序退出时写完队列中剩余的记录。
+    
+    Args:
+        handlers (list): 实际输出日志的 handler，需要各自设置好 formatter
+        level: 根 logger 的级别
+        
+    Returns:
+        QueueListener
+    """
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    # 队列中的记录已合并参数，格式由实际输出的 handler 决定
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=level, handlers=[queue_handler])
+    return listener
+
+
+def default_worker_config():
+    """根据 CPU 核心数估算线程数和批处理大小"""
+    cpu_count = multiprocessing.cpu_count()
+    if cpu_count >= 8:
+        return min(cpu_count // 2, 8), 100
+    return max(2, cpu_count - 1), 50
+
+
+def default_cache_dir():
+    """缓存目录，与图形界面共用"""
+    return os.path.join(os.path.expanduser("~"), ".photo_organizer", "cache")
+
+
+class PhotoOrganizerEngine:
+    """照片整理引擎
+    
+    整理选项保存为普通属性，消息以 (类型, 内容) 元组放入 progress_queue，
+    类型为 "progress"、"status"、"message" 或 "file"（逐个文件的结果，
+    内容为 (结果, 文件名)）。文件处理进度记录在 progress
+    （ProgressTracker）中，由界面按固定频率取样。
+    """
+    def __init__(self, progress_queue=None, max_workers=None, batch_size=None,
+                 cache_dir=None, use_cache=True, logger=None, file_log_level=None):
+        self.logger = logger or logging.getLogger('PhotoOrganizer')
+        
+        # 逐个文件的日志（已移动、跳过、文件名解析等）使用子 logger，可以单独调整级别
+        self.file_logger = logging.getLogger(f"{self.logger.name}.files")
+        if file_log_level is not None:
+            self.set_file_log_level(file_log_level)
+        self.progress_queue = progress_queue
+        self.running = False
+        
+        # 整理选项
+        self.move_files = False
+        self.copy_mode = "copy"  # 不移动时的放置方式："copy"、"hardlink" 或 "reflink"
+        self.include_subfolders = True
+        self.organize_by = "month"  # "month" 按年/月，"year" 仅按年
+        self.time_methods = [True, True, True]  # EXIF、文件名、修改时间
+        self.filename_first = False  # 文件名带完整时间（到秒）时直接采用，不再读取 EXIF
+        self.check_duplicates = True
+        self.check_similar = False
+        self.copy_buffer_size = COPY_BUFFER_SIZE
+        self.copy_preallocate = True
+        
+        # 线程池在第一次整理时创建，之前可以随时调整 max_workers
+        default_workers, default_batch = default_worker_config()
+        self.max_workers = max_workers or default_workers
+        self.batch_size = batch_size or default_batch
+        self.executor = None
+        self._executor_workers = 0
+        
+        # 目标目录锁，保证多线程下重名文件的序号分配不冲突
+        self._dir_locks = {}
+        self._dir_locks_guard = Lock()
+        self._copy_stats_lock = Lock()
+        self._unlink_lock = Lock()
+        # 正在查找或放入图库的文件大小，保证相同内容的文件不会同时放入
+        self._inflight_sizes = set()
+        self._inflight_cond = Condition()
+        self._move_budget = ByteBudget(MOVE_INFLIGHT_BYTES)
+        self.progress = ProgressTracker()
+        self.reset_stats()
+        
+        # 打开元数据缓存和图库索引，失败时不使用
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.metadata_cache = None
+        self.library_index = None
+        if use_cache:
+            self._open_caches(self.cache_dir)
+        
+        # 操作日志在每次整理时按源目录和目标目录打开
+        self.use_journal = True
+        self.journal = None
+
+    def _open_caches(self, cache_dir):
+        """打开元数据缓存和图库索引"""
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.metadata_cache = MetadataCache(os.path.join(cache_dir, "metadata.db"))
+            self.logger.info(f"元数据缓存: {self.metadata_cache.db_path}")
+        except Exception as e:
+            self.logger.error(f"打开元数据缓存失败: {str(e)}")
+            self.metadata_cache = None
+        
+        # 图库索引不可用时重复检查退回到完整扫描
+        try:
+            self.library_index = LibraryIndex(os.path.join(cache_dir, "library.db"))
+            self.logger.info(f"图库索引: {self.library_index.db_path}")
+        except Exception as e:
+            self.logger.error(f"打开图库索引失败: {str(e)}")
+            self.library_index = None
+
+    def set_file_log_level(self, level):
+        """设置逐个文件日志的级别，可以是 logging 常量或 "debug"、"info" 等名称"""
+        if isinstance(level, str):
+            if level.lower() not in FILE_LOG_LEVELS:
+                self.logger.warning(f"未知的文件日志级别: {level}")
+                return
+            level = FILE_LOG_LEVELS[level.lower()]
+        self.file_logger.setLevel(level)
+
+    def _report(self, msg_type, msg):
+        """发送进度或消息"""
+        if self.progress_queue is not None:
+            self.progress_queue.put((msg_type, msg))
+
+    def reset_stats(self):
+        """重置处理计数"""
+        # total_files 在扫描过程中递增，表示"已找到"的文件数
+        self.total_files = 0
+        self.processed_files = 0
+        self.skipped_files = 0
+        self.duplicate_files = 0
+        self.similar_groups = 0
+        self.cleaned_dirs = 0
+        self.error_files = []
+        self.copied_bytes = 0
+        self.linked_files = 0
+        self.resumed_files = 0
+        self._pending_unlinks = []
+        self._link_unsupported = set()
+        self.copy_seconds = 0.0  # 各线程复制耗时之和
+        self.duration = 0
+        self.stopped = False
+        self._scan_finished = False
+        self._reserved_paths = set()
+        self._dir_listings = {}
+        self._placed_paths = set()
+        self._track_placed = False
+        self._placed_files = []
+        self._dedup_enabled = False
+        self.progress.reset()
+
+    def stats(self):
+        """返回本次整理的统计"""
+        return {
+            'total': self.total_files,
+            'processed': self.processed_files,
+            'skipped': self.skipped_files,
+            'duplicates': self.duplicate_files,
+            'similar_groups': self.similar_groups,
+            'errors': len(self.error_files),
+            'linked': self.linked_files,
+            'resumed': self.resumed_files,
+            'copied_bytes': self.copied_bytes,
+            'copy_seconds': round(self.copy_seconds, 3),
+            'duration': self.duration,
+            'stopped': self.stopped,
+        }
+
+    def run(self, source_dir, target_dir):
+        """整理 source_dir 中的文件到 target_dir，返回统计字典"""
+        self.running = True
+        start_time = time.time()
+        self.reset_stats()
+        completed = False
+        try:
+            self._ensure_executor()
+            self._open_journal(source_dir, target_dir)
+            self._organize(source_dir, target_dir)
+            completed = True
+        finally:
+            # 出错退出时也删除已经复制并校验过的源文件
+            self.flush_pending_unlinks()
+            # 全部完成时删除操作日志，停止或出错时保留，下次从中断处继续
+            self._close_journal(completed and self.running)
+            self.duration = round(time.time() - start_time, 1)
+            self.stopped = not self.running
+            self.running = False
+            self.progress.finish()
+            self.flush()
+        return self.stats()
+
+    def _open_journal(self, source_dir, target_dir):
+        """打开本次整理的操作日志，存在上次中断留下的记录时从中断处继续"""
+        if not self.use_journal:
+            return
+        try:
+            journal_dir = os.path.join(self.cache_dir, "journal")
+            os.makedirs(journal_dir, exist_ok=True)
+            key = "\0".join(os.path.normcase(os.path.abspath(path)) for path in (source_dir, target_dir))
+            name = hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+            settings = f"{self.move_files}|{self.copy_mode}|{self.organize_by}"
+            self.journal = OperationJournal(os.path.join(journal_dir, f"{name}.log"), settings)
+        except Exception as e:
+            self.logger.error(f"打开操作日志失败: {str(e)}")
+            self.journal = None
+            return
+        if self.journal.entries:
+            done = sum(1 for entry in self.journal.entries.values() if entry[0] == "C")
+            self._report("message", f"发现上次未完成的整理，已完成 {done} 个文件，从中断处继续")
+
+    def _close_journal(self, completed):
+        if self.journal is None:
+            return
+        try:
+            self.journal.close(completed)
+        except Exception as e:
+            self.logger.error(f"关闭操作日志失败: {str(e)}")
+        self.journal = None
+
+    def _ensure_executor(self):
+        """按当前 max_workers 创建线程池，线程数变化时重建"""
+        if self.executor is not None and self._executor_workers == self.max_workers:
+            return
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='PhotoWorker'
+        )
+        self._executor_workers = self.max_workers
+
+    def _organize(self, source_dir, target_dir):
+        """整理流程：扫描并放置文件，然后检查重复和相似图片"""
+        # 目标目录位于源目录内时，记录本次放置的文件，避免扫描时重复处理
+        self._track_placed = self._is_subpath(target_dir, source_dir)
+        self._dedup_enabled = self.check_duplicates
+        
+        # 图库尚未建立索引时先记录现有文件，使导入时的重复检查覆盖整个图库
+        if (self._dedup_enabled and self.library_index is not None
+                and os.path.isdir(target_dir)
+                and not self.library_index.is_built(self._library_root(target_dir))):
+            self._report("status", "正在建立图库索引...")
+            self._index_library(target_dir)
+
+        # 初始化进度显示
+        self._report("status", "正在扫描文件...")
+        self.progress.start_stage("已处理", total_final=False)
+
+        # 扫描线程与处理线程池并行：扫描结果经有界队列按批次交给线程池
+        file_queue = queue.Queue(maxsize=self.batch_size * self.max_workers * 2)
+        scanner_thread = Thread(
+            target=self._file_scanner,
+            args=(self.iter_valid_files(source_dir), file_queue),
+            name='PhotoScanner',
+            daemon=True
+        )
+        scanner_thread.start()
+
+        self._run_batches(self._iter_batches(file_queue, scanner_thread), target_dir)
+        self.flush_pending_unlinks()
+
+        if not self.running:
+            self.logger.info("检测到停止信号")
+
+        if self.total_files == 0:
+            self._report("message", "未找到需要处理的文件")
+            return
+
+        self._report("message", f"共找到 {self.total_files} 个文件需要处理")
+        
+        # 检查重复文件
+        if self._dedup_enabled and self.running:
+            self.check_duplicate_files(target_dir)
+            
+        # 查找相似图片
+        if self.check_similar and self.running:
+            self.find_similar_images(target_dir)
+
+    def stop(self):
+        """请求停止，正在处理的批次结束后退出"""
+        self.running = False
+
+    def flush(self):
+        """提交缓存和图库索引"""
+        for store in (self.metadata_cache, self.library_index):
+            if store is not None:
+                try:
+                    store.flush()
+                except Exception as e:
+                    self.logger.error(f"写入缓存失败: {str(e)}")
+
+    def clear_caches(self):
+        """清空元数据缓存和图库索引"""
+        for store in (self.metadata_cache, self.library_index):
+            if store is not None:
+                store.clear()
+
+    def close(self):
+        """停止处理，关闭线程池和缓存"""
+        self.running = False
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        for store in (self.metadata_cache, self.library_index):
+            if store is not None:
+                try:
+                    store.close()
+                except Exception as e:
+                    self.logger.error(f"关闭缓存失败: {str(e)}")
+
+    def process_single_file(self, file_path, target_dir):
+        """处理单个文件"""
+        try:
+            # 上次跨磁盘移动已复制完成、源文件还没删除时，不再重新整理
+            if self._finish_interrupted_move(file_path, target_dir):
+                return True
+            
+            # 先查询缓存；文件元数据只在需要 EXIF 时间时才读取
+            cache_entry = self._get_cache_entry(file_path)
+            
+            # 获取文件时间
+            file_time = self.get_file_time(file_path, cache_entry=cache_entry)
+            if not file_time:
+                raise ValueError("无法获取文件时间")
+            
+            # 获取件分类
+            category = self.get_file_category(file_path, cache_entry=cache_entry)
+            
+            # 构建目标路径
+            year = file_time.strftime("%Y")
+            month = file_time.strftime("%m")
+            filename = os.path.basename(file_path)
+            
+            # 构建目标目录
+            if self.organize_by == "month":
+                if category == 'photos':
+                    target_subdir = os.path.join(target_dir, year, month)
+                else:
+                    target_subdir = os.path.join(target_dir, year, month, category)
+            else:
+                if category == 'photos':
+                    target_subdir = os.path.join(target_dir, year)
+                else:
+                    target_subdir = os.path.join(target_dir, year, category)
+            
+            # 检源文件是否已经在正确的位置
+            current_dir = os.path.dirname(file_path)
+            if os.path.normpath(current_dir) == os.path.normpath(target_subdir):
+                self.file_logger.info("文件已在正确位置: %s", file_path)
+                return False  # 返回False表示跳过
+
+            # 图库中任意位置已有相同内容的文件时不再放入。同样大小的文件逐个查找和放入，
+            # 相同内容的多个文件同时导入时，后面的文件能在图库索引中找到第一个
+            claimed_size = None
+            if self._dedup_enabled and self.library_index is not None:
+                claimed_size = os.path.getsize(file_path)
+                self._claim_size(claimed_size)
+            try:
+                if claimed_size is not None:
+                    existing_path = self._find_in_library(file_path, target_dir, cache_entry)
+                    if existing_path:
+                        self.file_logger.info("图库中已存在相同内容的文件，跳过: %s (%s)", filename, existing_path)
+                        return "duplicate"
+                return self._place_file(file_path, target_dir, target_subdir, cache_entry)
+            finally:
+                if claimed_size is not None:
+                    self._release_size(claimed_size)
+            
+        except Exception as e:
+            raise ValueError(f"文件操作失败: {str(e)}")
+
+    def _place_file(self, file_path, target_dir, target_subdir, cache_entry):
+        """在 target_subdir 中确定不重名的目标路径，移动、链接或复制文件
+        
+        Returns:
+            bool: True 表示已放入，False 表示目标位置已有相同文件而跳过
+        """
+        filename = os.path.basename(file_path)
+        
+        # 目标目录的文件名列表（第一次用到时创建目录并读取一次）
+        listing = self._get_dir_listing(target_subdir)
+
+        # 在目录锁内确定目标路径并预留，避免多个线程选中同一个序号
+        with self._get_dir_lock(target_subdir):
+            target_path = os.path.join(target_subdir, filename)
+
+            # 如果目标件已存在，添序号
+            if filename in listing:
+                if target_path not in self._reserved_paths and os.path.exists(target_path):
+                    # 如果是相文件，跳过处理
+                    if os.path.samefile(file_path, target_path):
+                        self.file_logger.info("跳过相同文件: %s", file_path)
+                        return False
+
+                    # 检查文件大小是否相同
+                    if os.path.getsize(file_path) == os.path.getsize(target_path):
+                        self.file_logger.info("目标位置已存在相同大小的文件，跳过: %s", filename)
+                        return False
+
+                # 如果文件不同，添加序号
+                target_path = os.path.join(target_subdir, listing.next_free_name(filename))
+
+            listing.add(os.path.basename(target_path))
+            self._reserved_paths.add(target_path)
+            op_id = self.journal.planned(file_path, target_path) if self.journal is not None else None
+            if self._track_placed:
+                self._placed_paths.add(os.path.normcase(target_path))
+
+        # 移动或复文件
+        placed = False
+        commit_later = False
+        try:
+            if op_id is not None:
+                self.journal.started(op_id)
+            if self.move_files and self._is_cross_device(file_path, target_subdir):
+                # 源文件删除后才在操作日志中记录完成
+                self._move_across_devices(file_path, target_path, cache_entry, op_id)
+                commit_later = True
+                self.file_logger.info("已移动: %s -> %s", filename, target_path)
+            elif self.move_files:
+                shutil.move(file_path, target_path, copy_function=self._copy_file)
+                self.file_logger.info("已移动: %s -> %s", filename, target_path)
+            elif self._link_file(file_path, target_path):
+                self.file_logger.info("已链接: %s -> %s", filename, target_path)
+            else:
+                partial_path = target_path + PARTIAL_SUFFIX
+                self._copy_file(file_path, partial_path)
+                os.replace(partial_path, target_path)
+                self.file_logger.info("已复制: %s -> %s", filename, target_path)
+            placed = True
+            if op_id is not None and not commit_later:
+                self.journal.committed(op_id)
+            self._record_placement(file_path, target_path, target_dir, cache_entry)
+            return True  # 返回 True 表示处理成功
+
+        except Exception as e:
+            self.logger.error(f"处理文件失败 {file_path}: {str(e)}")
+            if op_id is not None and not placed:
+                self.journal.failed(op_id)
+            raise
+        finally:
+            # 文件已落盘（或失败），释放预留；失败时文件名可以再次使用
+            with self._get_dir_lock(target_subdir):
+                self._reserved_paths.discard(target_path)
+                if not placed:
+                    listing.discard(os.path.basename(target_path))
+
+    def _finish_interrupted_move(self, file_path, target_dir):
+        """完成上次中断的移动：目标文件已存在且与源文件内容相同时删除源文件
+        
+        跨磁盘移动复制并校验后，源文件要累积到一批才删除，程序在此之前中断时
+        操作日志中停留在 S。这时目标文件已经完整（临时文件校验后才改名），
+        比较大小和摘要一致后删除源文件并记录完成；不一致时返回 False，按新文件整理。
+        """
+        if not self.move_files or self.journal is None:
+            return False
+        resume = self.journal.lookup(file_path)
+        if not resume or resume[0] != "S":
+            return False
+        _, target_path, op_id = resume
+        try:
+            if (not os.path.isfile(target_path)
+                    or os.path.getsize(target_path) != os.path.getsize(file_path)
+                    or file_digest(target_path) != file_digest(file_path)):
+                return False
+        except OSError:
+            return False
+        self.file_logger.info("上次已复制到 %s，删除源文件: %s", target_path, file_path)
+        self._queue_unlink(file_path, op_id)
+        self._record_placement(file_path, target_path, target_dir, None)
+        return True
+
+    def _claim_size(self, size):
+        """等待同样大小的其他文件放置完成后，占用该大小"""
+        with self._inflight_cond:
+            while size in self._inflight_sizes:
+                self._inflight_cond.wait()
+            self._inflight_sizes.add(size)
+
+    def _release_size(self, size):
+        with self._inflight_cond:
+            self._inflight_sizes.discard(size)
+            self._inflight_cond.notify_all()
+
+    def _link_file(self, src, dst):
+        """按 copy_mode 创建硬链接或 reflink，不需要链接或无法链接时返回 False 由调用方复制
+        
+        跨磁盘或文件系统不支持时，同一对设备之后不再尝试。
+        """
+        if self.copy_mode not in ("hardlink", "reflink"):
+            return False
+        devices = (os.stat(src).st_dev, os.stat(os.path.dirname(dst)).st_dev)
+        if devices in self._link_unsupported:
+            return False
+        try:
+            if self.copy_mode == "hardlink":
+                os.link(src, dst)
+            else:
+                reflink_file(src, dst + PARTIAL_SUFFIX)
+                os.replace(dst + PARTIAL_SUFFIX, dst)
+        except OSError as e:
+            if e.errno not in LINK_FALLBACK_ERRNOS:
+                raise
+            # 单个文件的硬链接数达到上限时只对该文件改为复制
+            if e.errno == errno.EMLINK:
+                return False
+            with self._copy_stats_lock:
+                first_failure = devices not in self._link_unsupported
+                self._link_unsupported.add(devices)
+            if first_failure:
+                mode_name = "硬链接" if self.copy_mode == "hardlink" else "reflink"
+                self.logger.warning(f"无法创建{mode_name}（{e.strerror}），"
+                                    f"{os.path.dirname(src)} -> {os.path.dirname(dst)} 改为复制")
+            return False
+        with self._copy_stats_lock:
+            self.linked_files += 1
+        return True
+
+    def _is_cross_device(self, src, target_subdir):
+        """源文件和目标目录是否在不同的磁盘（文件系统）上"""
+        return os.stat(src).st_dev != os.stat(target_subdir).st_dev
+
+    def _move_across_devices(self, src, dst, cache_entry, op_id=None):
+        """跨磁盘移动：复制到临时文件并写入磁盘，校验通过后改为目标文件名，把源文件加入待删除队列
+        
+        校验内容：复制的字节数等于源文件大小，复制前后源文件的大小和修改时间不变；
+        缓存中已有该文件的摘要（例如重复检查时计算过）时，还要与复制时计算的摘要一致。
+        没有已知摘要时不另外读取源文件或目标文件比较内容，复制时计算的摘要
+        只保存到缓存，供图库索引和重复检查使用。
+        
+        多个线程同时复制的数据量受 _move_budget 限制。校验失败时删除临时文件并保留源文件。
+        """
+        before = os.stat(src)
+        hasher = hashlib.blake2b()
+        partial_path = dst + PARTIAL_SUFFIX
+        self._move_budget.acquire(before.st_size)
+        try:
+            copied = self._copy_file(src, partial_path, hasher=hasher, fsync=True)
+        finally:
+            self._move_budget.release(before.st_size)
+        digest = hasher.hexdigest()
+        
+        # 复制的字节数、复制前后源文件的状态一致，且有已知摘要时摘要也一致，才算校验通过
+        after = os.stat(src)
+        known_digest = cache_entry['digest'] if cache_entry else None
+        if (copied != before.st_size
+                or (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns)
+                or (known_digest and known_digest != digest)):
+            os.remove(partial_path)
+            raise ValueError("复制校验失败，已保留源文件")
+        os.replace(partial_path, dst)
+        if cache_entry is not None:
+            cache_entry['digest'] = digest
+        self._queue_unlink(src, op_id)
+
+    def _queue_unlink(self, path, op_id=None):
+        """加入待删除队列，累积到 MOVE_UNLINK_BATCH 个时批量删除"""
+        with self._unlink_lock:
+            self._pending_unlinks.append((path, op_id))
+            if len(self._pending_unlinks) < MOVE_UNLINK_BATCH:
+                return
+            batch, self._pending_unlinks = self._pending_unlinks, []
+        self._unlink_sources(batch)
+
+    def flush_pending_unlinks(self):
+        """删除所有已校验但尚未删除的源文件"""
+        with self._unlink_lock:
+            batch, self._pending_unlinks = self._pending_unlinks, []
+        self._unlink_sources(batch)
+
+    def _unlink_sources(self, pending):
+        """删除源文件，删除后在操作日志中记录该移动已完成"""
+        for path, op_id in pending:
+            try:
+                os.remove(path)
+            except OSError as e:
+                self.logger.error(f"删除源文件失败 {path}: {str(e)}（目标文件已复制并校验）")
+                continue
+            if op_id is not None and self.journal is not None:
+                self.journal.committed(op_id)
+
+    def _copy_file(self, src, dst, hasher=None, fsync=False):
+        """复制单个文件并记录字节数和耗时，用于统计复制吞吐量，返回复制的字节数"""
+        start = time.perf_counter()
+        copied = copy_file(src, dst, self.copy_buffer_size, self.copy_preallocate, hasher, fsync)
+        elapsed = time.perf_counter() - start
+        with self._copy_stats_lock:
+            self.copied_bytes += copied
+            self.copy_seconds += elapsed
+        self.file_logger.debug("复制 %s: %.1f MB, %.1f MB/s", os.path.basename(src),
+                               copied / (1024 * 1024), copied / max(elapsed, 1e-6) / (1024 * 1024))
+        return copied
+
+    def get_file_time(self, file_path, metadata=None, cache_entry=None):
+        """获取文件的时间信息
+        
+        Args:
+            metadata (dict): get_file_metadata 的结果，未提供时按需读取
+            cache_entry (dict): _get_cache_entry 的结果，未提供时自行查询
+        """
+        def is_valid_year(year):
+            """检查年份是否有效（1970-2100）"""  # 修复"份"字
+            return 1970 <= year <= 2100
+        
+        # 缓存中有相同时间获取方式下的结果时直接使用
+        if cache_entry is None:
+            cache_entry = self._get_cache_entry(file_path)
+        methods_key = self._time_methods_key()
+        if cache_entry and cache_entry['capture_time'] and cache_entry['time_methods'] == methods_key:
+            return datetime.fromisoformat(cache_entry['capture_time'])
+
+        methods = []
+        if self.filename_first and self.time_methods[1]:
+            # 文件名带完整时间时不必打开文件读取 EXIF
+            methods.append(lambda path: self.get_filename_time(path, require_time=True))
+        if self.time_methods[0]:  # EXIF
+            methods.append(lambda path: self.get_exif_time(path, metadata, cache_entry))
+        if self.time_methods[1]:  # 文件名
+            methods.append(self.get_filename_time)
+        if self.time_methods[2]:  # 修改时间
+            methods.append(self.get_modified_time)
+            
+        # 前面的方式因无法读取文件（网络存储超时、权限不足等）失败时，
+        # 后面方式的结果不写入缓存，下次整理时重新读取
+        read_failed = False
+        for method in methods:
+            try:
+                time = method(file_path)
+                if time and is_valid_year(time.year):
+                    if not read_failed:
+                        self._update_cache(cache_entry, capture_time=time.isoformat(),
+                                           time_methods=methods_key)
+                    return time
+            except OSError:
+                read_failed = True
+            except:
+                continue
+                
+        # 如果所有方都失败，使用当前时间
+        self.file_logger.warning("无法获取有效的文件时间，用当时间: %s", file_path)
+        return datetime.now()
+
+    def get_exif_time(self, file_path, metadata=None, cache_entry=None):
+        """从EXIF信息获取间
+        
+        结果（包括没有拍摄时间）写入缓存的 exif_time，文件不变时不再重新读取。
+        文件无法读取时抛出 OSError，不写入缓存，下次整理时重新读取。
+        """
+        if cache_entry and cache_entry['exif_time'] is not None:
+            return datetime.fromisoformat(cache_entry['exif_time']) if cache_entry['exif_time'] else None
+        if metadata is None:
+            metadata = self.get_file_metadata(file_path)
+        capture_time = metadata['capture_time']
+        self._update_cache(cache_entry, exif_time=capture_time.isoformat() if capture_time else '')
+        return capture_time
+
+    def get_file_metadata(self, file_path):
+        """打开一次文件，读取拍摄时间、制造商、型号、尺寸和方向
+        
+        Returns:
+            dict: 无法读取的字段为 None
+            
+        Raises:
+            OSError: 文件无法打开或读取
+        """
+        file_format, metadata = read_file_metadata(file_path)
+        if file_format is None:
+            self.file_logger.debug("不支持读取元数据的格式: %s", file_path)
+        return metadata
+
+    def get_filename_time(self, file_path, require_time=False):
+        """从文件名获取时间
+        
+        Args:
+            require_time (bool): 只接受带时刻的结果（如 IMG_20230512_143022、毫秒时间戳），
+                只有日期时返回 None
+        """
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        parsed = parse_filename_time(stem)
+        if not parsed:
+            self.file_logger.debug("无法从文件名解析时间: %s", stem)
+            return None
+        result_time, has_time = parsed
+        if require_time and not has_time:
+            return None
+        self.file_logger.debug("从文件名解析时间: %s -> %s", stem, result_time)
+        return result_time
+
+    def get_modified_time(self, file_path):
+        """获文件修改时间"""
+        return datetime.fromtimestamp(os.path.getmtime(file_path))
+
+    def is_valid_file(self, file_path):
+        """检查是否为有效的图片文件"""
+        try:
+            if not os.path.isfile(file_path):
+                self.logger.debug(f"是文件: {file_path}")
+                return False
+            
+            if not file_path.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.heic')):
+                self.logger.debug(f"是支持图片格式: {file_path}")
+                return False
+            
+            file_size = os.path.getsize(file_path)
+            if not (0 < file_size < 500 * 1024 * 1024):
+                self.logger.debug(f"文件大小不符合要求: {file_path} ({file_size} bytes)")
+                return False
+            
+            return True
+        except Exception as e:
+            self.logger.error(f"检查文件有效性时出错 {file_path}: {str(e)}")
+            return False
+
+    def get_file_category(self, file_path, metadata=None, cache_entry=None):
+        """获取文件分类"""
+        if cache_entry is None:
+            cache_entry = self._get_cache_entry(file_path)
+        if cache_entry and cache_entry['category']:
+            return cache_entry['category']
+            
+        category = self._detect_file_category(file_path, metadata)
+        self._update_cache(cache_entry, category=category)
+        return category
+
+    def _detect_file_category(self, file_path, metadata=None):
+        """根据文件名和EXIF判断文件分类"""
+        # 检查文件名是否匹配任何分类关键词
+        stem = os.path.splitext(os.path.basename(file_path))[0].lower()
+        category = classify_filename(stem)
+        if category:
+            return category
+        
+        # 已读取EXIF时，通过制造商或型号判断是否为相机照片（不为此单独打开文件）
+        if metadata is not None and (metadata['make'] or metadata['model']):
+            return 'photos'
+        
+        # 默认返回 photos 类别
+        return 'photos'
+
+    def _record_placement(self, source_path, target_path, target_dir, cache_entry):
+        """记录放入图库的文件并更新图库索引"""
+        if self._dedup_enabled:
+            self._placed_files.append(target_path)
+        if self.library_index is None:
+            return
+        try:
+            stat = os.stat(target_path)
+            digest = cache_entry['digest'] if cache_entry else None
+            if self.move_files:
+                self.library_index.remove(source_path)
+            self.library_index.add(self._library_root(target_dir), target_path,
+                                   stat.st_size, stat.st_mtime_ns, digest)
+        except Exception as e:
+            self.logger.debug(f"更新图库索引失败 {target_path}: {str(e)}")
+
+    def _find_in_library(self, file_path, target_dir, cache_entry):
+        """在图库索引中查找与该文件内容相同的文件
+        
+        先按大小过滤，只有图库中存在相同大小的文件时才计算摘要。
+        
+        Returns:
+            str: 图库中已存在的文件路径，没有时返回 None
+        """
+        root = self._library_root(target_dir)
+        size = os.path.getsize(file_path)
+        if size == 0:
+            return None
+            
+        source_key = os.path.normcase(os.path.abspath(file_path))
+        rows = [row for row in self.library_index.find_by_size(root, size)
+                if os.path.normcase(os.path.abspath(row[0])) != source_key]
+        if not rows:
+            return None
+            
+        if cache_entry and cache_entry['digest']:
+            digest = cache_entry['digest']
+        else:
+            digest = self.get_file_digest(file_path)
+            if cache_entry:
+                cache_entry['digest'] = digest
+                
+        for path, mtime_ns, row_digest in rows:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # 文件已不存在
+                self.library_index.remove(path)
+                continue
+            if stat.st_size != size:
+                self.library_index.add(root, path, stat.st_size, stat.st_mtime_ns)
+                continue
+            if row_digest is None or stat.st_mtime_ns != mtime_ns:
+                row_digest = self.get_file_digest(path)
+                self.library_index.add(root, path, size, stat.st_mtime_ns, row_digest)
+            if row_digest == digest:
+                return path
+        return None
+
+    def _index_library(self, target_dir):
+        """将目标目录中的现有文件记录到图库索引（只读取文件大小和修改时间）"""
+        root = self._library_root(target_dir)
+        count = 0
+        for dir_path, _, files in os.walk(target_dir):
+            for filename in files:
+                if not self.running:
+                    return
+                # 整理中断时留下的临时文件不是图库内容
+                if filename.endswith(PARTIAL_SUFFIX):
+                    continue
+                file_path = os.path.join(dir_path, filename)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                if stat.st_size > 0:
+                    self.library_index.add(root, file_path, stat.st_size, stat.st_mtime_ns)
+                    count += 1
+        self.library_index.flush()
+        self.logger.info(f"已记录图库中的 {count} 个文件: {root}")
+
+    def _library_root(self, target_dir):
+        """图库索引中使用的目标目录标识"""
+        return os.path.normcase(os.path.abspath(target_dir))
+
+    def _get_cache_entry(self, file_path):
+        """查询文件的缓存记录
+        
+        Returns:
+            dict: 包含缓存字段和用于回写的 key；缓存不可用时返回 None
+        """
+        if self.metadata_cache is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+            key = (file_path, stat.st_size, stat.st_mtime_ns)
+            entry = self.metadata_cache.get(*key) or dict.fromkeys(MetadataCache.FIELDS)
+            entry['key'] = key
+            return entry
+        except Exception as e:
+            self.logger.debug(f"查询缓存失败 {file_path}: {str(e)}")
+            return None
+
+    def _update_cache(self, cache_entry, **fields):
+        """将结果写回缓存"""
+        if cache_entry is None or self.metadata_cache is None:
+            return
+        cache_entry.update(fields)
+        try:
+            self.metadata_cache.put(*cache_entry['key'], **fields)
+        except Exception as e:
+            self.logger.debug(f"写入缓存失败: {str(e)}")
+
+    def _time_methods_key(self):
+        """当前启用的时间获取方式，用于区分缓存中的时间结果"""
+        key = ''.join('1' if enabled else '0' for enabled in self.time_methods)
+        return key + 'f' if self.filename_first else key
+
+    def check_duplicate_files(self, target_dir):
+        """查标目录中的重复文件
+        
+        图库已建立索引时，只检查本次放入的文件（在索引中查找相同大小的文件，
+        再按需比较完整摘要）；否则完整扫描目标目录并同时建立索引。
+        只有完整内容一致的文件才会被删除。
+        """
+        try:
+            self.logger.info("开检查重复文件...")
+            self._report("message", "开始检查重复文件...")
+            
+            root = self._library_root(target_dir)
+            if self.library_index is not None and self.library_index.is_built(root):
+                duplicate_groups = self._find_new_duplicates(root)
+            else:
+                duplicate_groups = self._find_all_duplicates(target_dir, root)
+            if duplicate_groups is None:  # 已停止
+                return
+            
+            duplicate_count = sum(len(paths) - 1 for paths in duplicate_groups)
+            self.duplicate_files += duplicate_count
+            
+            # 处理重复
+            if duplicate_count > 0:
+                self.logger.info(f"发现 {duplicate_count} 个重复文件")
+                self._report("message", f"现 {duplicate_count} 个重复文件")
+                
+                for file_paths in duplicate_groups:
+                    # 保留最新的文件
+                    newest_file = max(file_paths, key=os.path.getctime)
+                    file_paths.remove(newest_file)
+                    
+                    # 删除其他重复文件
+                    for file_path in file_paths:
+                        try:
+                            os.remove(file_path)
+                            if self.library_index is not None:
+                                self.library_index.remove(file_path)
+                            self.logger.info(f"删重文件: {file_path} (与 {newest_file} 内容相同)")
+                            self._report("message", f"删除重复文件: {os.path.basename(file_path)}")
+                        except Exception as e:
+                            self.logger.error(f"删除文件失败 {file_path}: {str(e)}")
+            
+            self._report("message", "重复文件检查完成")
+            self.logger.info("重复文件检查完成")
+            
+        except Exception as e:
+            self.logger.error(f"检查重复文件时出错: {str(e)}")
+            self._report("message", f"检查重复文件时错: {str(e)}")
+
+    def _find_all_duplicates(self, target_dir, root):
+        """完整扫描目标目录查找重复文件，同时建立图库索引
+        
+        逐级筛选：先按文件大小分组，再比较头尾摘要，最后只对仍然相同的
+        文件计算完整内容摘要。目录只遍历一次，摘要在线程池中并行计算。
+        
+        Returns:
+            list: 重复文件分组 [[file_paths]]；停止处理时返回 None
+        """
+        # 第一步：按文件大小分组（空文件不参与比较），并记录到索引
+        size_groups = {}  # {size: [file_paths]}
+        mtimes = {}
+        for dir_path, _, files in os.walk(target_dir):
+            for filename in files:
+                if not self.running:
+                    return None
+                # 整理中断时留下的临时文件不是图库内容
+                if filename.endswith(PARTIAL_SUFFIX):
+                    continue
+                file_path = os.path.join(dir_path, filename)
+                try:
+                    stat = os.stat(file_path)
+                except OSError as e:
+                    self.logger.error(f"处理文件失败 {file_path}: {str(e)}")
+                    continue
+                if stat.st_size > 0:
+                    size_groups.setdefault(stat.st_size, []).append(file_path)
+                    mtimes[file_path] = stat.st_mtime_ns
+                    if self.library_index is not None:
+                        self.library_index.add(root, file_path, stat.st_size, stat.st_mtime_ns)
+        
+        # 第二步：并行计算头尾摘要
+        tasks = [(path, size) for size, paths in size_groups.items() if len(paths) > 1
+                 for path in paths]
+        del size_groups
+        partials = self._parallel_digests(
+            tasks, lambda path, size: partial_digest(path, size), "检查重复文件 - 头尾摘要",
+            max_read=128 * 1024)
+        if partials is None:
+            return None
+        
+        partial_groups = {}  # {(size, partial_digest): [file_paths]}
+        for file_path, file_size in tasks:
+            if file_path in partials:
+                partial_groups.setdefault((file_size, partials[file_path]), []).append(file_path)
+        
+        # 第三步：只对头尾摘要相同的文件并行计算完整摘要
+        tasks = [(path, key[0]) for key, paths in partial_groups.items() if len(paths) > 1
+                 for path in paths]
+        fulls = self._parallel_digests(
+            tasks, lambda path, size: self.get_file_digest(path), "检查重复文件 - 完整摘要")
+        if fulls is None:
+            return None
+        
+        full_groups = {}  # {(size, digest): [file_paths]}
+        for file_path, file_size in tasks:
+            if file_path in fulls:
+                full_groups.setdefault((file_size, fulls[file_path]), []).append(file_path)
+                if self.library_index is not None:
+                    self.library_index.add(root, file_path, file_size, mtimes[file_path],
+                                           fulls[file_path])
+        
+        if self.library_index is not None:
+            self.library_index.mark_built(root)
+            self.logger.info(f"图库索引已建立: {root}")
+            
+        return [paths for paths in full_groups.values() if len(paths) > 1]
+
+    def _find_new_duplicates(self, root):
+        """只检查本次放入图库的文件
+        
+        在索引中查找与新文件大小相同的文件，核对它们仍然存在且未变化，
+        再比较完整摘要（索引中已有的摘要直接使用）。
+        
+        Returns:
+            list: 重复文件分组 [[file_paths]]；停止处理时返回 None
+        """
+        candidates = {}  # {path: (size, mtime_ns, digest)}
+        for new_path in self._placed_files:
+            if not self.running:
+                return None
+            try:
+                size = os.path.getsize(new_path)
+            except OSError:
+                continue
+            if size == 0:
+                continue
+                
+            rows = self.library_index.find_by_size(root, size)
+            if len(rows) < 2:
+                continue
+                
+            for path, mtime_ns, digest in rows:
+                if path in candidates:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # 文件已不存在
+                    self.library_index.remove(path)
+                    continue
+                if stat.st_size != size:
+                    self.library_index.add(root, path, stat.st_size, stat.st_mtime_ns)
+                    continue
+                if stat.st_mtime_ns != mtime_ns:
+                    digest = None
+                candidates[path] = (size, stat.st_mtime_ns, digest)
+        
+        # 并行计算缺少的摘要
+        tasks = [(path, size) for path, (size, _, digest) in candidates.items() if digest is None]
+        digests = self._parallel_digests(
+            tasks, lambda path, size: self.get_file_digest(path), "检查重复文件 - 完整摘要")
+        if digests is None:
+            return None
+        
+        groups = {}  # {(size, digest): [file_paths]}
+        for path, (size, mtime_ns, digest) in candidates.items():
+            if digest is None:
+                digest = digests.get(path)
+                if digest is None:
+                    continue
+                self.library_index.add(root, path, size, mtime_ns, digest)
+            groups.setdefault((size, digest), []).append(path)
+            
+        self.logger.info(f"增量重复检查: 新文件 {len(self._placed_files)} 个, 候选 {len(candidates)} 个")
+        return [paths for paths in groups.values() if len(paths) > 1]
+
+    def find_similar_images(self, target_dir, max_distance=6):
+        """查找目标目录中内容相近的图片（重新编码、压缩、轻微编辑的副本）
+        
+        为每张图片计算 64 位 dHash（结果写入元数据缓存），放入 BK 树后
+        查询汉明距离不超过 max_distance 的图片并分组。相似图片只记录在
+        日志中，不会被删除。
+        """
+        try:
+            self.logger.info("开始查找相似图片...")
+            self._report("message", "开始查找相似图片...")
+            
+            tasks = []
+            for dir_path, _, files in os.walk(target_dir):
+                for filename in files:
+                    if os.path.splitext(filename)[1].lower() in SIMILAR_IMAGE_EXTENSIONS:
+                        file_path = os.path.join(dir_path, filename)
+                        try:
+                            tasks.append((file_path, os.path.getsize(file_path)))
+                        except OSError:
+                            continue
+                            
+            hashes = self._parallel_digests(
+                tasks, lambda path, size: self.get_image_hash(path), "查找相似图片")
+            if hashes is None:
+                return
+            
+            # 建立 BK 树并查询相近的哈希，用并查集合并成组
+            tree = BKTree()
+            for file_path, value in hashes.items():
+                tree.add(value, file_path)
+                
+            parent = {}
+            def find(path):
+                while path in parent:
+                    path = parent[path]
+                return path
+                
+            for file_path, value in hashes.items():
+                for _, other in tree.search(value, max_distance):
+                    if other != file_path:
+                        a, b = find(file_path), find(other)
+                        if a != b:
+                            parent[b] = a
+                            
+            groups = {}
+            for file_path in parent:
+                groups.setdefault(find(file_path), []).append(file_path)
+            similar = [sorted(set(paths) | {root}) for root, paths in groups.items()]
+            
+            self.similar_groups = len(similar)
+            for paths in similar:
+                self.logger.info(f"相似图片: {', '.join(paths)}")
+            self._report("message", f"发现 {len(similar)} 组相似图片，详见日志文件")
+            self.logger.info(f"相似图片查找完成，共 {len(hashes)} 张图片，{len(similar)} 组相似")
+            
+        except Exception as e:
+            self.logger.error(f"查找相似图片时出错: {str(e)}")
+            self._report("message", f"查找相似图片时出错: {str(e)}")
+
+    def get_image_hash(self, file_path):
+        """获取图片的感知哈希，优先使用缓存"""
+        cache_entry = self._get_cache_entry(file_path)
+        if cache_entry and cache_entry['phash']:
+            return int(cache_entry['phash'], 16)
+        value = dhash(file_path)
+        self._update_cache(cache_entry, phash=f"{value:016x}")
+        return value
+
+    def _parallel_digests(self, tasks, digest_func, stage_name, max_read=None):
+        """在线程池中并行计算摘要，进度和吞吐量记录在 progress 中
+        
+        hashlib 在计算大块数据时会释放 GIL，多个线程可以同时读取和计算。
+        
+        Args:
+            tasks (list): [(file_path, size)]
+            digest_func: digest_func(file_path, size) -> str
+            stage_name (str): 显示在状态栏中的阶段名称
+            max_read (int): 每个文件最多读取的字节数，用于统计吞吐量
+            
+        Returns:
+            dict: {file_path: digest}，读取失败的文件不包含在内；停止处理时返回 None
+        """
+        if not tasks:
+            return {}
+        
+        results = {}
+        pending = {}
+        max_pending = self.max_workers * 4
+        total = len(tasks)
+        done_count = 0
+        done_bytes = 0
+        start_time = time.time()
+        self.progress.start_stage(stage_name, total)
+        
+        def collect(futures):
+            nonlocal done_count, done_bytes
+            for future in futures:
+                file_path, file_size = pending.pop(future)
+                read_bytes = 0
+                try:
+                    results[file_path] = future.result()
+                    read_bytes = file_size if max_read is None else min(file_size, max_read)
+                except Exception as e:
+                    self.logger.error(f"计算文件摘要失败 {file_path}: {str(e)}")
+                done_count += 1
+                done_bytes += read_bytes
+                self.progress.add(1, read_bytes)
+        
+        for file_path, file_size in tasks:
+            if not self.running:
+                break
+            pending[self.executor.submit(digest_func, file_path, file_size)] = (file_path, file_size)
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        
+        if not self.running:
+            for future in pending:
+                future.cancel()
+            return None
+            
+        collect(list(as_completed(pending)))
+        self.progress.finish()
+        
+        elapsed = max(time.time() - start_time, 1e-6)
+        self.logger.info(f"{stage_name}: {done_count} 个文件, "
+                         f"{done_bytes / (1024 * 1024):.1f} MB, "
+                         f"{done_bytes / elapsed / (1024 * 1024):.1f} MB/s")
+        return results
+
+    def get_file_digest(self, file_path):
+        """获取文件完整内容摘要，优先使用缓存"""
+        cache_entry = self._get_cache_entry(file_path)
+        if cache_entry and cache_entry['digest']:
+            return cache_entry['digest']
+        digest = file_digest(file_path)
+        self._update_cache(cache_entry, digest=digest)
+        return digest
+
+    def cleanup_empty_dirs(self, target_dir):
+        """清理空目录无效目录"""
+        try:
+            self.logger.info("开始清理目录...")
+            self._report("message", "开清目录...")
+            
+            # 要删除的特殊文件/目录模式
+            special_patterns = [
+                '.DS_Store',      # Mac系统文件
+                'Thumbs.db',      # Windows缩略图文件
+                '._.DS_Store',    # Mac元数
+                '._*',            # Mac隐藏文件
+                'desktop.ini',    # Windows面置文件
+                '.spotlight*',    # Mac Spotlight索引
+                '.fseventsd',     # Mac文件系事件
+                '.Trashes'        # Mac收
+            ]
+            
+            cleaned_count = 0
+            
+            # 从下往上遍历目录（先处理子目录）
+            for root, dirs, files in os.walk(target_dir, topdown=False):
+                # 删除特殊文件
+                for file in files:
+                    file_path = os.path.join(root, file)
+                    # 检查是否配特殊件模式
+                    if any(fnmatch.fnmatch(file.lower(), pattern.lower()) for pattern in special_patterns):
+                        try:
+                            os.remove(file_path)
+                            self.logger.info(f"删除特文件: {file_path}")
+                            cleaned_count += 1
+                        except Exception as e:
+                            self.logger.error(f"删除文件失败 {file_path}: {str(e)}")
+                
+                # 检查目录是否为空或只包含特殊文件
+                try:
+                    # 重获取目录内容（因可能已删除了些文件）
+                    remaining_files = [f for f in os.listdir(root) 
+                                     if not any(fnmatch.fnmatch(f.lower(), p.lower()) 
+                                              for p in special_patterns)]
+                    
+                    # 如果目录为空或包含特件
+                    if not remaining_files:
+                        # 保不目标根目录
+                        if root != target_dir:
+                            try:
+                                # 除有剩内容并删除目录
+                                shutil.rmtree(root)
+                                self.logger.info(f"删除空目录: {root}")
+                                cleaned_count += 1
+                            except Exception as e:
+                                self.logger.error(f"删除目录失败 {root}: {str(e)}")
+                
+                except Exception as e:
+                    self.logger.error(f"处理目录失败 {root}: {str(e)}")
+            
+            self.logger.info(f"清理成，共清理 {cleaned_count} 个项目")
+            self._report("message", f"清理完成，共清理 {cleaned_count} 个项目")
+            
+        except Exception as e:
+            self.logger.error(f"清理过出错: {str(e)}")
+            self._report("message", f"清理错误: {str(e)}")
+
+    def _file_scanner(self, file_iterator, file_queue):
+        """文件扫描线程"""
+        start_time = time.time()
+        try:
+            for file_path in file_iterator:
+                if not self._put_until_stopped(file_queue, file_path):
+                    break
+                self.total_files += 1
+                self.progress.set_total(self.total_files)
+                
+                # 每1000个文件更新一次状态
+                if self.total_files % 1000 == 0:
+                    elapsed = time.time() - start_time
+                    speed = self.total_files / elapsed if elapsed > 0 else 0
+                    self.logger.debug(f"已扫描 {self.total_files} 个文件 ({speed:.0f} 文件/秒)")
+        except Exception as e:
+            self.logger.error(f"文件扫描线程出错: {str(e)}")
+        finally:
+            self._scan_finished = True
+            self.progress.set_total(self.total_files, final=True)
+            self.logger.info(f"文件扫描完成，共找到 {self.total_files} 个文件")
+            # 放入结束标记
+            self._put_until_stopped(file_queue, None)
+
+    def _put_until_stopped(self, file_queue, item):
+        """向有界队列放入数据，队列满时等待，停止处理后放弃"""
+        while self.running:
+            try:
+                file_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def iter_valid_files(self, source_dir):
+        """生成有效文件的迭代器"""
+        include_subfolders = self.include_subfolders
+        try:
+            for root, dirs, files in os.walk(source_dir):
+                # 不包含子目录时只扫描源目录本身
+                if not include_subfolders:
+                    dirs[:] = []
+                    
+                for file in files:
+                    if not self.running:
+                        return
+                        
+                    if os.path.splitext(file)[1].lower() not in SUPPORTED_EXTENSIONS:
+                        continue
+                    
+                    file_path = os.path.join(root, file)
+                    # 跳过本次运行刚放入目标目录的文件
+                    if self._track_placed and os.path.normcase(file_path) in self._placed_paths:
+                        continue
+                    yield file_path
+                        
+        except Exception as e:
+            self.logger.error(f"遍历文时出错: {str(e)}")
+
+    def _collect_batch(self, file_queue, scanner_thread):
+        """收集一批文件进行处理
+        
+        Returns:
+            tuple: (batch, finished)，finished 表示扫描已结束且队列已取完
+        """
+        batch = []
+        try:
+            while len(batch) < self.batch_size:
+                try:
+                    file_path = file_queue.get(timeout=0.1)
+                except queue.Empty:
+                    # 已有文件时先交给线程池处理，不等待批次填满
+                    if batch:
+                        break
+                    if not scanner_thread.is_alive() or not self.running:
+                        return batch, True
+                    continue
+                    
+                if file_path is None:  # 扫描结束标记
+                    return batch, True
+                batch.append(file_path)
+            
+            return batch, False
+            
+        except Exception as e:
+            self.logger.error(f"集批次失败: {str(e)}")
+            return batch, True
+
+    def _iter_batches(self, file_queue, scanner_thread):
+        """从扫描队列中依次取出批次"""
+        while self.running:
+            batch, finished = self._collect_batch(file_queue, scanner_thread)
+            if batch:
+                yield batch
+            if finished:
+                return
+
+    def _is_subpath(self, path, parent):
+        """判断 path 是否位于 parent 目录内（含相同目录）"""
+        try:
+            path = os.path.normcase(os.path.abspath(path))
+            parent = os.path.normcase(os.path.abspath(parent))
+            return os.path.commonpath([path, parent]) == parent
+        except ValueError:
+            # 不同盘符
+            return False
+
+    def _process_batch(self, batch, target_dir):
+        """优化的批处理（在工作线程中执行）"""
+        results = []
+
+        for file_path in batch:
+            if not self.running:
+                break
+
+            # 上次中断前已经完成的文件不再处理
+            if self.journal is not None and self.journal.is_committed(file_path):
+                self.progress.add(1)
+                results.append((file_path, True, "resumed"))
+                continue
+
+            try:
+                # 在移动之前取得大小，用于统计吞吐量
+                file_size = os.path.getsize(file_path)
+                result = self.process_single_file(file_path, target_dir)
+                self.progress.add(1, file_size if result is True else 0)
+                if result == "duplicate":
+                    results.append((file_path, True, "duplicate"))
+                elif result:
+                    results.append((file_path, True, None))
+                else:
+                    results.append((file_path, True, "skipped"))
+
+            except Exception as e:
+                self.logger.error(f"处理文件失败 {file_path}: {str(e)}", exc_info=True)
+                self.progress.add(1)
+                results.append((file_path, False, str(e)))
+
+        return results
+
+    def _run_batches(self, batches, target_dir):
+        """将批次分发到线程池，并在当前线程汇总结果
+
+        同时提交的批次数限制为线程数的两倍，避免一次性堆积大量任务。
+        计数只在调用线程中更新，工作线程之间不共享计数器。
+        """
+        pending = set()
+        max_pending = self.max_workers * 2
+
+        for batch in batches:
+            if not self.running:
+                break
+            if not batch:
+                continue
+            pending.add(self.executor.submit(self._process_batch, batch, target_dir))
+
+            # 达到上限时等待至少一个批次完成
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._collect_results(future)
+
+        # 停止时取消尚未开始的批次
+        if not self.running:
+            for future in pending:
+                future.cancel()
+
+        for future in as_completed(pending):
+            self._collect_results(future)
+
+    def _collect_results(self, future):
+        """汇总一个批次的处理结果（进度由工作线程直接记录在 progress 中）"""
+        if future.cancelled():
+            return
+
+        try:
+            results = future.result()
+        except Exception as e:
+            self.logger.error(f"批处理失败: {str(e)}", exc_info=True)
+            return
+
+        for file_path, ok, info in results:
+            if not ok:
+                self.error_files.append((file_path, info))
+                continue
+            if info == "skipped":
+                self.skipped_files += 1
+                outcome = "跳过"
+            elif info == "duplicate":
+                self.skipped_files += 1
+                self.duplicate_files += 1
+                outcome = "跳过"
+            elif info == "resumed":
+                self.skipped_files += 1
+                self.resumed_files += 1
+                outcome = "上次已完成"
+            else:
+                self.processed_files += 1
+                outcome = "已整理"
+            self._report("file", (outcome, os.path.basename(file_path)))
+
+    def _get_dir_listing(self, directory):
+        """获取目标目录的文件名列表，目录不存在时先创建
+        
+        每次整理开始时清空，整理过程中只读取一次目录。
+        """
+        key = os.path.normcase(os.path.normpath(directory))
+        with self._dir_locks_guard:
+            listing = self._dir_listings.get(key)
+        if listing is None:
+            os.makedirs(directory, exist_ok=True)
+            listing = DirectoryListing(directory)
+            with self._dir_locks_guard:
+                listing = self._dir_listings.setdefault(key, listing)
+        return listing
+
+    def _get_dir_lock(self, directory):
+        """获取目标目录对应的锁"""
+        key = os.path.normcase(os.path.normpath(directory))
+        with self._dir_locks_guard:
+            lock = self._dir_locks.get(key)
+            if lock is None:
+                lock = self._dir_locks[key] = Lock()
+            return lock
+
+
+TIME_METHOD_NAMES = ('exif', 'filename', 'mtime')
+
+
+def _parse_time_methods(value):
+    """解析 --time-methods，例如 "exif,filename" """
+    names = [name.strip().lower() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in TIME_METHOD_NAMES]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(
+            f"无效的时间获取方式: {value}（可选: {', '.join(TIME_METHOD_NAMES)}）")
+    return [name in names for name in TIME_METHOD_NAMES]
+
+
+def build_arg_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(
+        prog='photo_engine',
+        description='按拍摄时间整理照片和视频（无界面模式）')
+    parser.add_argument('source', help='源目录')
+    parser.add_argument('target', help='目标目录')
+    placement = parser.add_mutually_exclusive_group()
+    placement.add_argument('--move', action='store_true', help='移动文件（默认复制）')
+    placement.add_argument('--link', choices=('hardlink', 'reflink'),
+                           help='同一文件系统上用硬链接或写时复制（reflink）代替复制，不可用时自动复制')
+    parser.add_argument('--group', choices=('month', 'year'), default='month',
+                        help='目录结构：年/月 或 仅按年（默认 month）')
+    parser.add_argument('--time-methods', type=_parse_time_methods,
+                        default=[True, True, True], metavar='LIST',
+                        help='时间获取方式，逗号分隔，按顺序尝试（默认 exif,filename,mtime）')
+    parser.add_argument('--filename-first', action='store_true',
+                        help='文件名带完整时间（如 IMG_20230512_143022、毫秒时间戳）时直接采用，不读取 EXIF')
+    parser.add_argument('--no-subfolders', action='store_true', help='不扫描子文件夹')
+    parser.add_argument('--check-duplicates', action='store_true',
+                        help='检查并删除目标目录中的重复文件，已存在的文件不再放入')
+    parser.add_argument('--check-similar', action='store_true', help='查找相似图片并写入日志')
+    parser.add_argument('--workers', type=int, help='线程数')
+    parser.add_argument('--batch-size', type=int, help='批处理大小')
+    parser.add_argument('--no-cache', action='store_true', help='不使用元数据缓存和图库索引')
+    parser.add_argument('--no-journal', action='store_true',
+                        help='不记录操作日志（中断后重新运行时不能从中断处继续）')
+    parser.add_argument('--copy-buffer', type=int, metavar='MB',
+                        help=f'复制缓冲区大小（MB，默认 {COPY_BUFFER_SIZE // (1024 * 1024)}，'
+                             '仅在不支持零拷贝复制时使用）')
+    parser.add_argument('--no-preallocate', action='store_true', help='复制大文件前不预分配目标空间')
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument('-v', '--verbose', action='store_true', help='输出每个文件的处理日志')
+    verbosity.add_argument('-q', '--quiet', action='store_true', help='只输出错误和最终结果')
+    parser.add_argument('--file-log-level', choices=sorted(FILE_LOG_LEVELS, key=FILE_LOG_LEVELS.get),
+                        help='逐个文件日志的级别（默认与 -v/-q 相同，debug 显示文件名解析过程）')
+    return parser
+
+
+def main(argv=None):
+    """命令行入口，返回退出码：0 成功，1 有文件处理失败，130 被中断"""
+    args = build_arg_parser().parse_args(argv)
+    
+    if args.verbose:
+        level = logging.INFO
+    elif args.quiet:
+        level = logging.ERROR
+    else:
+        level = logging.WARNING
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    start_queue_logging([stream_handler], level)
+    
+    source_dir = os.path.abspath(args.source)
+    target_dir = os.path.abspath(args.target)
+    if not os.path.isdir(source_dir):
+        print(f"源目录不存在: {source_dir}", file=sys.stderr)
+        return 2
+    
+    progress_queue = queue.Queue()
+    engine = PhotoOrganizerEngine(
+        progress_queue=progress_queue,
+        max_workers=args.workers,
+        batch_size=args.batch_size,
+        use_cache=not args.no_cache,
+        file_log_level=args.file_log_level
+    )
+    engine.move_files = args.move
+    engine.copy_mode = args.link or "copy"
+    engine.include_subfolders = not args.no_subfolders
+    engine.organize_by = args.group
+    engine.time_methods = args.time_methods
+    engine.filename_first = args.filename_first
+    engine.check_duplicates = args.check_duplicates
+    engine.check_similar = args.check_similar
+    if args.copy_buffer:
+        engine.copy_buffer_size = args.copy_buffer * 1024 * 1024
+    engine.copy_preallocate = not args.no_preallocate
+    engine.use_journal = not args.no_journal
+    
+    # 引擎在后台线程运行，主线程输出进度并响应 Ctrl+C
+    # （不用 Thread.join 轮询：join 被 KeyboardInterrupt 打断后 is_alive 可能不准确）
+    result = {}
+    done = Event()
+    def worker():
+        try:
+            result.update(engine.run(source_dir, target_dir))
+        except Exception as e:
+            engine.logger.error(f"处理错误: {str(e)}", exc_info=True)
+            result['failed'] = True
+        finally:
+            done.set()
+    
+    Thread(target=worker, name='PhotoEngine', daemon=True).start()
+    
+    interrupted = False
+    last_status = 0
+    while True:
+        try:
+            finished = done.wait(0.2)
+            while True:
+                try:
+                    msg_type, msg = progress_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if args.quiet:
+                    continue
+                if msg_type == "message":
+                    print(msg, file=sys.stderr)
+                elif msg_type == "status":
+                    print(msg, file=sys.stderr)
+            
+            # 每秒输出一次处理进度
+            if not args.quiet and time.time() - last_status >= 1:
+                last_status = time.time()
+                snapshot = engine.progress.snapshot()
+                if snapshot is not None:
+                    print(snapshot['status'], file=sys.stderr)
+            if finished:
+                break
+        except KeyboardInterrupt:
+            if interrupted:
+                break
+            interrupted = True
+            print("正在停止，等待当前批次完成...（再次按 Ctrl+C 立即退出）", file=sys.stderr)
+            engine.stop()
+    
+    engine.close()
+    
+    if result:
+        title = "处理已停止" if engine.stopped else "处理完成!"
+        print(f"{title} 耗时: {engine.duration}秒")
+        print(f"处理文件总数: {engine.total_files}个")
+        print(f"成功处理: {engine.processed_files}个")
+        print(f"跳过文件: {engine.skipped_files}个")
+        if engine.resumed_files:
+            print(f"上次已完成: {engine.resumed_files}个")
+        if engine.linked_files:
+            print(f"链接文件: {engine.linked_files}个")
+        if engine.copied_bytes:
+            copied_mb = engine.copied_bytes / (1024 * 1024)
+            print(f"复制数据: {copied_mb:.1f} MB（单文件平均 "
+                  f"{copied_mb / max(engine.copy_seconds, 1e-6):.1f} MB/s，"
+                  f"整体 {copied_mb / max(engine.duration, 0.1):.1f} MB/s）")
+        if args.check_duplicates:
+            print(f"发现重复文件: {engine.duplicate_files}个")
+        if args.check_similar:
+            print(f"相似图片: {engine.similar_groups}组")
+        if engine.error_files:
+            print(f"处理失败: {len(engine.error_files)}个")
+            for file, error in engine.error_files:
+                print(f"- {file}: {error}", file=sys.stderr)
+    
+    if interrupted:
+        return 130
+    if result.get('failed') or engine.error_files:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
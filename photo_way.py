@@ -1,28 +1,26 @@
 # -*- coding: utf-8 -*-
+import time
+LAUNCH_TIME = time.perf_counter()  # 用于统计启动耗时
+
 import os
-import shutil
 from datetime import datetime
-import re
-from PIL import Image
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from threading import Thread
 import queue
-import warnings
 import json
 import os.path
 import logging
 from logging.handlers import RotatingFileHandler
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import multiprocessing
-import fnmatch
 import sys
 import subprocess
 import tkinter.font as tkfont
-import time
-import psutil
+from collections import deque
+from itertools import islice
 
-warnings.filterwarnings("ignore", category=Image.DecompressionBombWarning)
+# psutil 导入较慢，只在用到的方法里导入
+from photo_engine import PhotoOrganizerEngine, default_worker_config, start_queue_logging
 
 class ModernButton(ttk.Button):
     """Custom modern style button"""
@@ -30,6 +28,120 @@ class ModernButton(ttk.Button):
         style_name = kwargs.pop('style', 'Modern.TButton')
         super().__init__(master, style=style_name, **kwargs)
 
+class LogView:
+    """界面日志区域
+    
+    日志记录保存在有界的环形缓冲区中，文本框只渲染当前可见的几行，
+    追加日志的开销不随记录数增长。逐个文件的消息（已整理、跳过等）只计数，
+    定时合并为一条汇总显示，完整内容见日志文件。
+    """
+    MAX_RECORDS = 5000
+    RENDER_DELAY_MS = 50
+    SUMMARY_INTERVAL_MS = 1000
+
+    def __init__(self, text, v_scrollbar, max_records=MAX_RECORDS):
+        self.text = text
+        self.v_scrollbar = v_scrollbar
+        self.records = deque(maxlen=max_records)  # (内容, 标签)，最新的在右端
+        self.offset = 0  # 视图顶部与最新记录相隔的行数
+        self._pending = {}  # 类别 -> [数量, 最近的文件名, 标签]
+        self._render_scheduled = False
+        self._summary_scheduled = False
+        self._line_height = max(1, tkfont.Font(font=text.cget('font')).metrics('linespace'))
+        
+        # 滚动由视图自己处理，文本框中只有可见的几行
+        v_scrollbar.configure(command=self.yview)
+        text.configure(yscrollcommand='')
+        text.bind('<Configure>', lambda e: self._schedule_render())
+        text.bind('<MouseWheel>', self._on_mousewheel)
+        text.bind('<Button-4>', lambda e: self._scroll(-3))
+        text.bind('<Button-5>', lambda e: self._scroll(3))
+
+    def append(self, line, tag='info'):
+        """追加一行"""
+        self.records.append((line, tag))
+        # 用户向下翻看时保持视图位置不变
+        if self.offset:
+            self.offset += 1
+        self._schedule_render()
+
+    def append_block(self, lines, tag='info'):
+        """追加多行内容，显示时保持原有的上下顺序"""
+        for line in reversed("\n".join(lines).split("\n")):
+            self.append(line, tag)
+
+    def count(self, kind, name, tag='info'):
+        """记录一条逐个文件的消息，稍后合并显示"""
+        entry = self._pending.setdefault(kind, [0, name, tag])
+        entry[0] += 1
+        entry[1] = name
+        if not self._summary_scheduled:
+            self._summary_scheduled = True
+            self.text.after(self.SUMMARY_INTERVAL_MS, self.flush_summaries)
+
+    def flush_summaries(self):
+        """把计数的逐个文件消息合并为汇总行"""
+        self._summary_scheduled = False
+        current_time = datetime.now().strftime("%H:%M:%S")
+        for kind, (count, name, tag) in self._pending.items():
+            if count == 1:
+                self.append(f"{current_time} • {kind}: {name}", tag)
+            else:
+                self.append(f"{current_time} • {kind} {count} 个文件（最近: {name}）", tag)
+        self._pending.clear()
+
+    def clear(self):
+        """清空全部记录"""
+        self.records.clear()
+        self._pending.clear()
+        self.offset = 0
+        self.render()
+
+    def visible_rows(self):
+        """文本框当前能显示的行数"""
+        return max(1, int(self.text.cget('height')), self.text.winfo_height() // self._line_height)
+
+    def render(self):
+        """只把可见的记录写入文本框"""
+        self._render_scheduled = False
+        rows = self.visible_rows()
+        total = len(self.records)
+        self.offset = max(0, min(self.offset, total - rows))
+        
+        self.text.delete('1.0', tk.END)
+        for line, tag in islice(reversed(self.records), self.offset, self.offset + rows):
+            self.text.insert(tk.END, line + '\n', tag)
+        
+        if total <= rows:
+            self.v_scrollbar.grid_remove()
+        else:
+            self.v_scrollbar.grid()
+            self.v_scrollbar.set(self.offset / total, (self.offset + rows) / total)
+
+    def yview(self, *args):
+        """滚动条回调"""
+        if args[0] == 'moveto':
+            self.offset = int(float(args[1]) * len(self.records))
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            self.offset += step * self.visible_rows() if args[2] == 'pages' else step
+        self.render()
+
+    def _scroll(self, step):
+        self.offset += step
+        self.render()
+        return 'break'
+
+    def _on_mousewheel(self, event):
+        return self._scroll(-1 if event.delta > 0 else 1)
+
+    def _schedule_render(self):
+        """合并短时间内的多次更新，只重绘一次"""
+        if not self._render_scheduled:
+            self._render_scheduled = True
+            self.text.after(self.RENDER_DELAY_MS, self.render)
+
+
 class PhotoOrganizerGUI:
     def __init__(self, root):
         self.root = root
@@ -71,6 +183,7 @@ class PhotoOrganizerGUI:
         
         # 初始化队列
         self.progress_queue = queue.Queue()
+        self._last_progress = None
         self.running = False
         
         # 先加载设置
@@ -79,10 +192,13 @@ class PhotoOrganizerGUI:
         # 初始化所有变量 - 使用加载的配置
         self.organize_by_month_var = tk.StringVar(value=self.settings.get('organize_by_month', 'month'))
         self.move_files_var = tk.BooleanVar(value=self.settings.get('move_files', False))
+        self.copy_mode_var = tk.StringVar(value=self.settings.get('copy_mode', 'copy'))
         self.include_subfolders_var = tk.BooleanVar(value=self.settings.get('include_subfolders', True))
         self.cleanup_enabled = tk.BooleanVar(value=self.settings.get('cleanup_enabled', True))
         self.check_duplicates_var = tk.BooleanVar(value=self.settings.get('check_duplicates', True))
+        self.check_similar_var = tk.BooleanVar(value=self.settings.get('check_similar', False))
         self.time_method_vars = [tk.BooleanVar(value=val) for val in self.settings.get('time_methods', [True, True, True])]
+        self.filename_first_var = tk.BooleanVar(value=self.settings.get('filename_first', False))
         
         # 计缩放子
         self.scale_factor = self.calculate_scale_factor()
@@ -133,20 +249,21 @@ class PhotoOrganizerGUI:
         if 'target_dir' in self.settings:
             self.target_entry.insert(0, self.settings['target_dir'])
         
-        # 检查进度队列
-        self.check_progress_queue()
-        
-        # 在初始化时获取系统配置
-        self.max_workers, self.batch_size = self.get_optimal_config()
+        # 先按 CPU 核心数估算线程配置，采样 CPU 使用率需要 1 秒，放到后台进行
+        self.max_workers, self.batch_size = default_worker_config()
         
-        # 创建线程池时使用优化后的配置
-        self.executor = ThreadPoolExecutor(
+        # 整理引擎（线程池、元数据缓存和图库索引）
+        self.engine = PhotoOrganizerEngine(
+            progress_queue=self.progress_queue,
             max_workers=self.max_workers,
-            thread_name_prefix='PhotoWorker'
+            batch_size=self.batch_size,
+            logger=self.logger,
+            file_log_level=self.settings.get('file_log_level', 'info')
         )
+        Thread(target=self._probe_system_config, name='ConfigProbe', daemon=True).start()
         
-        # 添加性能监控
-        self.monitor_system_resources()
+        # 检查进度队列
+        self.check_progress_queue()
         
         # 在窗口关闭时保存设置
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -171,20 +288,20 @@ class PhotoOrganizerGUI:
         # 设置日志文件名（包含日期）
         log_file = os.path.join(log_dir, f"photo_organizer_{datetime.now().strftime('%Y%m%d')}.log")
         
-        # 配置日志器
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                RotatingFileHandler(
-                    log_file, 
-                    maxBytes=10*1024*1024,  # 10MB
-                    backupCount=5,
-                    encoding='utf-8'
-                ),
-                logging.StreamHandler()  # 同时输出到控制台
-            ]
-        )
+        # 配置日志器：写文件和控制台在后台线程中进行，处理线程只把记录放入队列
+        handlers = [
+            RotatingFileHandler(
+                log_file, 
+                maxBytes=10*1024*1024,  # 10MB
+                backupCount=5,
+                encoding='utf-8'
+            ),
+            logging.StreamHandler()  # 同时输出到控制台
+        ]
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        self.log_listener = start_queue_logging(handlers, logging.INFO)
         
         self.logger = logging.getLogger('PhotoOrganizer')
         self.logger.info("程序启动")
@@ -193,19 +310,16 @@ class PhotoOrganizerGUI:
     def log_message(self, message, level='info'):
         """优化的日志显示"""
         try:
+            # 删除重复文件的消息只计数，由日志区域定时合并为汇总
+            if level == 'info' and message.startswith("删除重复文件:"):
+                self.log_view.count("删除重复文件", message.split(":", 1)[1].strip())
+                return
+            
             # 获取当前时间
             current_time = datetime.now().strftime("%H:%M:%S")
             
             # 根据不同类型的消显示格式
-            if "已移动:" in message or "已复制:" in message:
-                # 简化文件操作的显示
-                filename = os.path.basename(message.split("->")[1].strip())
-                formatted_message = f"{current_time} ➜ {filename}"
-            elif "跳过" in message:
-                # 简化跳过文件的显示
-                filename = os.path.basename(message.split(":")[1].strip())
-                formatted_message = f"{current_time} • 跳过: {filename}"
-            elif "错误" in message:
+            if "错误" in message:
                 # 错误信息保持完整
                 formatted_message = f"{current_time} ✕ {message}"
             elif "共找到" in message:
@@ -214,27 +328,18 @@ class PhotoOrganizerGUI:
             else:
                 # 其他信息简化显示
                 formatted_message = f"{current_time} • {message}"
-                
-            # 在文本框开始处插入消息并换行
-            self.log_text.insert('1.0', formatted_message + '\n')
-            
-            # 应用相应的标签样式
-            line_start = "1.0"
-            line_end = "2.0"
             
             # 根据消息类型设置颜色
             if level == 'error' or "错误" in message:
-                self.log_text.tag_add('error', line_start, line_end)
+                tag = 'error'
             elif level == 'warning' or "警告" in message:
-                self.log_text.tag_add('warning', line_start, line_end)
+                tag = 'warning'
             elif "跳过" in message:
-                self.log_text.tag_add('skip', line_start, line_end)
+                tag = 'skip'
             else:
-                self.log_text.tag_add('info', line_start, line_end)
-                
-            # 限制日志显示行数
-            if int(self.log_text.index('end-1c').split('.')[0]) > 100:
-                self.log_text.delete('end-50c', 'end')
+                tag = 'info'
+            
+            self.log_view.append(formatted_message, tag)
                 
         except Exception as e:
             print(f"记录日志失败: {str(e)}")
@@ -261,11 +366,10 @@ class PhotoOrganizerGUI:
         """停止整理"""
         try:
             if messagebox.askyesno("确认", "确定要停止处理吗？"):
-                self.running = False
+                # 引擎处理完当前批次后结束，界面在收到 "complete" 消息后恢复
+                self.engine.stop()
                 self.logger.info("用户手动停止处理")
-                
-                # 确保在主线程中更新UI
-                self.root.after(0, lambda: self.status_label.configure(text="已停止"))
+                self.status_label.configure(text="正在停止...")
                 
                 # 记录日志
                 self.log_message("处理已停止", level='warning')
@@ -275,147 +379,136 @@ class PhotoOrganizerGUI:
             self.log_message(f"停止处理时出错: {str(e)}", level='error')
 
     def process_files(self, source_dir, target_dir):
-        """处理文件的主函数"""
+        """处理文件的主函数（在后台线程中运行）
+        
+        不直接操作界面：结束后通过 progress_queue 发送 "complete" 消息，
+        由主线程的 check_progress_queue 显示结果。
+        """
+        result = {'source_dir': source_dir, 'target_dir': target_dir, 'error': None}
         try:
-            start_time = time.time()
-            # 获取所有文件
-            all_files = self.get_all_files(source_dir)
-            if not all_files:
-                self.progress_queue.put(("message", "未找到需要处理的文件"))
-                self.root.after(0, lambda: self.start_button.configure(state=tk.NORMAL))
-                self.root.after(0, lambda: self.stop_button.configure(state=tk.DISABLED))
-                return
-                
-            # 保存总文件数和已处理数量 - 修改为整数计数
-            self.total_files = len(all_files)
-            self.processed_files = 0
-            self.skipped_files = 0
-            self.duplicate_files = 0
-            self.cleaned_dirs = 0
-            self.error_files = []
-            
-            self.progress_queue.put(("message", f"共找到 {self.total_files} 个文件需要处理"))
-            
-            # 初始化进度显示
-            self.progress_queue.put(("status", f"已处理: 0/{self.total_files}"))
-            
-            # 处理每个文件
-            for file_path in all_files:
-                if not self.running:
-                    self.logger.info("检测到停止信号")
-                    break
-                    
-                try:
-                    result = self.process_single_file(file_path, target_dir)
-                    if result:  # 只有处理成功才计数
-                        self.processed_files += 1  # 使用加法而不是add方法
-                    else:
-                        self.skipped_files += 1
-                    
-                    # 更新进度和状态
-                    progress = (self.processed_files / self.total_files) * 100
-                    self.progress_queue.put(("progress", progress))
-                    self.progress_queue.put(("status", f"已处理: {self.processed_files}/{self.total_files}"))
-                    
-                    # 更新进度标签
-                    self.root.after(0, lambda: self.progress_status.configure(
-                        text=f"已处理: {self.processed_files}/{self.total_files}"
-                    ))
-                    self.root.after(0, lambda: self.progress_percent.configure(
-                        text=f"{progress:.1f}%"
-                    ))
-                    
-                except Exception as e:
-                    self.logger.error(f"处理文件失败 {file_path}: {str(e)}")
-                    self.error_files.append((file_path, str(e)))
-                    continue
-            
-            # 理完成后发送完成消息
-            end_time = time.time()
-            duration = round(end_time - start_time, 1)
-            
-            # 构建详细的结果日志
-            result_log = [
-                f"处理完成! 耗时: {duration}秒",
-                f"源目录: {source_dir}",
-                f"目标目录: {target_dir}",
-                f"处理文件总数: {self.total_files}个",
-                f"成功处理: {self.processed_files}个",
-                f"跳过文件: {self.skipped_files}个"
-            ]
-            
-            # 如果启用了重复检查，添加重复文件信息
-            if self.check_duplicates_var.get():
-                result_log.append(f"发现重复文件: {self.duplicate_files}个")
-                
-            # 如果有错误文件，添加错误信息
-            if self.error_files:
-                result_log.append(f"处理失败: {len(self.error_files)}个")
-                
-            # 如果启用了清理空目录，添加清理信息
-            if self.cleanup_enabled.get():
-                result_log.append(f"清理空目录: {self.cleaned_dirs}个")
-                
-            # 添加移动/复制模式信息
-            mode = "移动" if self.move_files_var.get() else "复制"
-            result_log.append(f"操作模式: {mode}")
-            
-            # 添加时间获取方式信息
-            time_methods = []
-            if self.time_method_vars[0].get(): time_methods.append("EXIF")
-            if self.time_method_vars[1].get(): time_methods.append("文件名")
-            if self.time_method_vars[2].get(): time_methods.append("修改时间")
-            result_log.append(f"时间获取方式: {', '.join(time_methods)}")
-            
-            # 加组织式息
-            organize_by = "年/月" if self.get_organize_by_month() == "month" else "年"
-            result_log.append(f"文件组织方式: {organize_by}")
-            
-            # 如果有处理失败的文件，添加详细信息
-            if self.error_files:
-                result_log.append("\n处理失败的文件:")
-                for file, error in self.error_files[:5]:  # 只显示前5个错误
-                    result_log.append(f"- {os.path.basename(file)}: {error}")
-                if len(self.error_files) > 5:
-                    result_log.append(f"... 等共{len(self.error_files)}个文件处理失败")
-            
-            # 在日志区域显示结果
-            self.log_text.configure(state='normal')
-            self.log_text.delete(1.0, tk.END)
-            self.log_text.insert(tk.END, "\n".join(result_log))
-            self.log_text.configure(state='disabled')
-            
-            # 自动滚动到顶部
-            self.log_text.see("1.0")
-            
-            # 如果有错误，弹出提示
-            if self.error_files:
-                messagebox.showwarning("处理完成", 
-                    f"处理完成，但有{len(self.error_files)}个文件处理失败，详细信息请查看日志。")
-            else:
-                messagebox.showinfo("处理完成", 
-                    f"所有文件处理完成！\n共处理: {self.processed_files}个文件\n耗时: {duration}秒")
-            
-            # 显示最终结果
-            self._show_final_results(
-                self.total_files, 
-                self.processed_files, 
-                len(self.error_files), 
-                self.skipped_files, 
-                duration
-            )
-            
+            self.engine.run(source_dir, target_dir)
         except Exception as e:
             self.logger.error(f"处理错误: {str(e)}", exc_info=True)
-            self.progress_queue.put(("message", f"处理出错: {str(e)}"))
+            result['error'] = str(e)
         finally:
-            # 确保在任何情况下都重置按钮状态
-            self.root.after(0, lambda: self.start_button.configure(state=tk.NORMAL))
-            self.root.after(0, lambda: self.stop_button.configure(state=tk.DISABLED))
+            self.progress_queue.put(("complete", result))
+
+    def _finish_organize(self, result):
+        """整理结束后在主线程中显示结果并恢复按钮状态"""
+        self.running = False
+        self.start_button.configure(state=tk.NORMAL)
+        self.stop_button.configure(state=tk.DISABLED)
+        
+        if result['error']:
+            self.status_label.configure(text="处理出错")
+            self.log_message(f"处理出错: {result['error']}", level='error')
+            return
+        
+        source_dir, target_dir = result['source_dir'], result['target_dir']
+        
+        # 同步引擎的处理计数
+        engine = self.engine
+        self.total_files = engine.total_files
+        self.processed_files = engine.processed_files
+        self.skipped_files = engine.skipped_files
+        self.duplicate_files = engine.duplicate_files
+        self.similar_groups = engine.similar_groups
+        self.cleaned_dirs = engine.cleaned_dirs
+        self.error_files = engine.error_files
+        
+        if engine.stopped:
+            self.status_label.configure(text="已停止")
+        else:
+            self.status_label.configure(text="已完成")
+        if self.total_files == 0:
+            return
+
+        duration = self.engine.duration
+        
+        # 构建详细的结果日志
+        result_log = [
+            f"处理完成! 耗时: {duration}秒",
+            f"源目录: {source_dir}",
+            f"目标目录: {target_dir}",
+            f"处理文件总数: {self.total_files}个",
+            f"成功处理: {self.processed_files}个",
+            f"跳过文件: {self.skipped_files}个"
+        ]
+        
+        # 如果启用了重复检查，添加重复文件信息
+        if self.check_duplicates_var.get():
+            result_log.append(f"发现重复文件: {self.duplicate_files}个")
+        if self.check_similar_var.get():
+            result_log.append(f"相似图片: {self.similar_groups}组")
+            
+        # 如果有错误文件，添加错误信息
+        if self.error_files:
+            result_log.append(f"处理失败: {len(self.error_files)}个")
+            
+        # 如果启用了清理空目录，添加清理信息
+        if self.cleanup_enabled.get():
+            result_log.append(f"清理空目录: {self.cleaned_dirs}个")
+            
+        # 添加移动/复制模式信息
+        result_log.append(f"操作模式: {self._operation_name()}")
+        
+        # 添加时间获取方式信息
+        time_methods = []
+        if self.time_method_vars[0].get(): time_methods.append("EXIF")
+        if self.time_method_vars[1].get(): time_methods.append("文件名")
+        if self.time_method_vars[2].get(): time_methods.append("修改时间")
+        if self.filename_first_var.get() and self.time_method_vars[1].get():
+            time_methods.append("文件名优先")
+        result_log.append(f"时间获取方式: {', '.join(time_methods)}")
+        
+        # 加组织式息
+        organize_by = "年/月" if self.get_organize_by_month() else "年"
+        result_log.append(f"文件组织方式: {organize_by}")
+        
+        # 如果有处理失败的文件，添加详细信息
+        if self.error_files:
+            result_log.append("\n处理失败的文件:")
+            for file, error in self.error_files[:5]:  # 只显示前5个错误
+                result_log.append(f"- {os.path.basename(file)}: {error}")
+            if len(self.error_files) > 5:
+                result_log.append(f"... 等共{len(self.error_files)}个文件处理失败")
+        
+        # 在日志区域显示结果
+        self.log_view.clear()
+        self.log_view.append_block(result_log)
+        
+        # 如果有错误，弹出提示
+        if self.error_files:
+            messagebox.showwarning("处理完成", 
+                f"处理完成，但有{len(self.error_files)}个文件处理失败，详细信息请查看日志。")
+        else:
+            messagebox.showinfo("处理完成", 
+                f"所有文件处理完成！\n共处理: {self.processed_files}个文件\n耗时: {duration}秒")
+        
+        # 显示最终结果
+        self._show_final_results(
+            self.total_files, 
+            self.processed_files, 
+            len(self.error_files), 
+            self.skipped_files, 
+            duration
+        )
+
+    def _sync_engine_options(self):
+        """把界面上的整理选项同步到引擎"""
+        self.engine.move_files = self.move_files_var.get()
+        self.engine.copy_mode = self.copy_mode_var.get()
+        self.engine.include_subfolders = self.include_subfolders_var.get()
+        self.engine.organize_by = "month" if self.get_organize_by_month() else "year"
+        self.engine.time_methods = [var.get() for var in self.time_method_vars]
+        self.engine.filename_first = self.filename_first_var.get()
+        self.engine.check_duplicates = self.check_duplicates_var.get()
+        self.engine.check_similar = self.check_similar_var.get()
 
     def _adjust_batch_size(self):
         """动态调整批次大"""
         try:
+            import psutil
             # 获取当前统状态
             cpu_percent = psutil.cpu_percent()
             memory = psutil.virtual_memory()
@@ -423,6 +516,7 @@ class PhotoOrganizerGUI:
             # 据CPU和内存动态调整
             if cpu_percent > 80 or memory.percent > 85:
                 self.batch_size = max(20, self.batch_size // 2)
+                self.engine.batch_size = self.batch_size
                 self.logger.warning(f"系统资源紧张，调整批处理大小: {self.batch_size}")
                 
             # 检查磁盘空间
@@ -442,7 +536,7 @@ class PhotoOrganizerGUI:
         # 显示当前设置
         self.log_message("\n⚙️ 当前设置:")
         self.log_message(f"├─ 整理方式: {'按年月' if self.organize_by_month_var.get() == 'month' else '仅按年'}")
-        self.log_message(f"├ {'移动' if self.move_files_var.get() else '复制'}文件")
+        self.log_message(f"├ {self._operation_name()}文件")
         self.log_message(f"├─ {'包含' if self.include_subfolders_var.get() else '不包含'}子目录")
         self.log_message(f"├─ {'启用' if self.cleanup_enabled.get() else '禁用'}清理空目录")
         self.log_message(f"└─ {'检查' if self.check_duplicates_var.get() else '不检'}重复文件")
@@ -480,6 +574,14 @@ class PhotoOrganizerGUI:
             gif_count = sum(1 for f in self.processed_files_by_type if f.endswith('.gif'))
             raw_count = sum(1 for f in self.processed_files_by_type if f.endswith(('.raw', '.cr2', '.nef', '.arw')))
             
+            # 复制的数据量和吞吐量（移动到同一磁盘时不复制数据）
+            copied_mb = self.engine.copied_bytes / (1024 * 1024)
+            copy_line = (f"    复制数据: {copied_mb:.1f} MB  |  "
+                         f"{copied_mb / max(self.engine.copy_seconds, 1e-6):.1f} MB/s\n"
+                         if self.engine.copied_bytes else "")
+            if self.engine.linked_files:
+                copy_line += f"    链接文件: {self.engine.linked_files} 个（未复制数据）\n"
+            
             # 构建摘要信息并显示在日志中
             summary = (
                 "\n" + "="*70 + "\n"
@@ -487,7 +589,8 @@ class PhotoOrganizerGUI:
                 "="*70 + "\n\n"
                 f"[整体情况]\n"
                 f"    总计处理: {total} 个文件  |  耗时: {self._format_time(total_time)}\n"
-                f"    处理速度: {total/total_time:.1f} 个/秒  |  成率: {(success/total*100):.1f}%\n\n"
+                f"    处理速度: {total/max(total_time, 0.1):.1f} 个/秒  |  成率: {(success/total*100):.1f}%\n"
+                f"{copy_line}\n"
                 f"[处理结果]\n"
                 f"    成功处理: {success} 个文件\n"
                 f"    处理失败: {errors} 个文件\n"
@@ -501,7 +604,7 @@ class PhotoOrganizerGUI:
                 f"    源目录:   {self.source_entry.get()}\n"
                 f"    目标目录: {self.target_entry.get()}\n\n"
                 f"[处理配置]\n"
-                f"    文件操作: {'移动' if self.move_files_var.get() else '复制'}文件\n"
+                f"    文件操作: {self._operation_name()}文件\n"
                 f"    子目录:   {'包含' if self.include_subfolders_var.get() else '不包含'}子目录\n"
                 f"    重复文件: {'检查' if self.check_duplicates_var.get() else '不检查'}重复\n"
                 f"    整理方式: {self.organize_by_month_var.get() == 'month' and '按年月' or '仅按年'}\n\n"
@@ -509,7 +612,7 @@ class PhotoOrganizerGUI:
             )
             
             # 在日志开头插入摘要
-            self.log_text.insert('1.0', summary)
+            self.log_view.append_block(summary.split("\n"))
             
             # 更新状态标签
             if errors == 0:
@@ -538,60 +641,6 @@ class PhotoOrganizerGUI:
         else:
             return "1分钟"  # 不到1分钟也显示1分钟
 
-    def _file_scanner(self, file_iterator, file_queue):
-        """文件扫描线程"""
-        try:
-            for file_path in file_iterator:
-                if not self.running:
-                    break
-                file_queue.put(file_path)
-                
-            # 放入结束标记
-            file_queue.put(None)
-        except Exception as e:
-            self.logger.error(f"文件扫描线程出错: {str(e)}")
-
-    def iter_valid_files(self, source_dir):
-        """生成有效文件的迭代器"""
-        try:
-            for root, _, files in os.walk(source_dir):
-                # 如果不包含子目录且不是源目录，则跳过
-                if not self.include_subfolders_var.get() and root != source_dir:
-                    continue
-                    
-                for file in files:
-                    if not self.running:
-                        return
-                        
-                    file_path = os.path.join(root, file)
-                    if self.is_valid_file(file_path):
-                        yield file_path
-                        
-        except Exception as e:
-            self.logger.error(f"遍历文时出错: {str(e)}")
-
-    def _collect_batch(self, file_queue, scanner_thread):
-        """收集一批文件进行处理"""
-        try:
-            batch = []
-            for _ in range(self.batch_size):
-                try:
-                    # 等待0.1秒，如果有新文件且扫描线程已结束，则退出
-                    file_path = file_queue.get(timeout=0.1)
-                    if file_path is None:  # 扫描结束标记
-                        break
-                    batch.append(file_path)
-                except queue.Empty:
-                    if not scanner_thread.is_alive():
-                        break
-                    continue
-            
-            return batch
-            
-        except Exception as e:
-            self.logger.error(f"集批次失败: {str(e)}")
-            return []
-
     def start_organize(self):
         """开始整理照片"""
         try:
@@ -617,6 +666,12 @@ class PhotoOrganizerGUI:
             # 启动进度检查
             self.check_progress_queue()
             
+            # 启动资源监控，整理期间每30秒检查一次
+            self.monitor_system_resources()
+            
+            # 整理选项在主线程中读取，后台线程不访问 Tk 变量
+            self._sync_engine_options()
+            
             # 启动处理线程
             Thread(target=self.process_files, args=(source_dir, target_dir), daemon=True).start()
             
@@ -943,8 +998,21 @@ class PhotoOrganizerGUI:
                         style='Custom.TCheckbutton').pack(side=tk.LEFT, padx=(0, self.scaled(20)))
         ttk.Checkbutton(process_inner, text="检查重复", 
                         variable=self.check_duplicates_var,
+                        style='Custom.TCheckbutton').pack(side=tk.LEFT, padx=(0, self.scaled(20)))
+        ttk.Checkbutton(process_inner, text="相似图片", 
+                        variable=self.check_similar_var,
                         style='Custom.TCheckbutton').pack(side=tk.LEFT)
         
+        # 不移动文件时的复制方式，硬链接和 reflink 在跨磁盘时自动改为复制
+        copy_mode_inner = ttk.Frame(process_frame, style='Card.TFrame')
+        copy_mode_inner.pack(fill=tk.X, padx=self.scaled(15), pady=(0, self.scaled(8)))
+        ttk.Label(copy_mode_inner, text="复制方式:", font=self.fonts['body']).pack(side=tk.LEFT, padx=(0, self.scaled(10)))
+        for text, value in (("完整复制", "copy"), ("硬链接", "hardlink"), ("写时复制(reflink)", "reflink")):
+            ttk.Radiobutton(copy_mode_inner, text=text, 
+                            variable=self.copy_mode_var,
+                            value=value,
+                            style='Custom.TRadiobutton').pack(side=tk.LEFT, padx=(0, self.scaled(20)))
+        
         # 3. 时间取
         time_frame = ttk.LabelFrame(options_inner, text="时间获取", style='Card.TLabelframe')
         time_frame.pack(fill=tk.X)
@@ -964,6 +1032,11 @@ class PhotoOrganizerGUI:
                            style='Custom.TCheckbutton').pack(side=tk.LEFT, 
                                                            padx=(0 if i == 0 else self.scaled(20), 
                                                                 0 if i == len(time_methods)-1 else 0))
+        
+        # 文件名带完整时间（如 IMG_20230512_143022）时直接采用，跳过 EXIF 读取
+        ttk.Checkbutton(time_inner, text="文件名优先", 
+                        variable=self.filename_first_var,
+                        style='Custom.TCheckbutton').pack(side=tk.LEFT, padx=(self.scaled(20), 0))
 
         # 创建主操作区域
         action_frame = ttk.Frame(self.main_frame, style='Card.TFrame')
@@ -1084,6 +1157,13 @@ class PhotoOrganizerGUI:
                   command=self.clear_config,
                   style='Small.TButton').pack(side=tk.RIGHT, padx=(self.scaled(5), 0))
 
+        # 重建缓存按钮
+        ttk.Button(button_frame,
+                  text="重建缓存",
+                  width=8,  # 固定按钮宽度
+                  command=self.rebuild_cache,
+                  style='Small.TButton').pack(side=tk.RIGHT, padx=(self.scaled(5), 0))
+
         # 查看完整日志按钮
         ttk.Button(button_frame,
                   text="查看日志",
@@ -1099,7 +1179,7 @@ class PhotoOrganizerGUI:
         text_inner = ttk.Frame(text_frame, style='Card.TFrame')
         text_inner.pack(fill=tk.BOTH, expand=True, padx=self.scaled(15))
         
-        # 日志文本框
+        # 日志文本框（由 LogView 只渲染可见的行）
         self.log_text = tk.Text(
             text_inner,
             font=self.fonts['small'],
@@ -1126,14 +1206,12 @@ class PhotoOrganizerGUI:
             spacing1=self.scaled(2))  # 减小行间距
         
         # 创建滚动
-        self.v_scrollbar = ttk.Scrollbar(text_inner, orient="vertical", command=self.log_text.yview)
+        self.v_scrollbar = ttk.Scrollbar(text_inner, orient="vertical")
         self.h_scrollbar = ttk.Scrollbar(text_inner, orient="horizontal", command=self.log_text.xview)
         
-        # 配置文本框的滚动
-        self.log_text.configure(
-            yscrollcommand=self.update_scrollbar_y,
-            xscrollcommand=self.update_scrollbar_x
-        )
+        # 配置文本框的滚动，垂直方向由 LogView 处理
+        self.log_text.configure(xscrollcommand=self.update_scrollbar_x)
+        self.log_view = LogView(self.log_text, self.v_scrollbar)
         
         # 使用网格布局
         self.log_text.grid(row=0, column=0, sticky="nsew", padx=(0, self.scaled(2)))
@@ -1175,6 +1253,7 @@ class PhotoOrganizerGUI:
                     if msg_type == "progress":
                         progress = float(msg)
                         self.progress_var.set(progress)
+                        self.progress_percent.configure(text=f"{progress:.1f}%")
                         
                     elif msg_type == "status":
                         # 更新进度状态文本
@@ -1183,21 +1262,36 @@ class PhotoOrganizerGUI:
                     elif msg_type == "message":
                         self.log_message(msg)
                         
+                    elif msg_type == "file":
+                        # 逐个文件的结果只计数，由日志区域定时合并为汇总
+                        outcome, filename = msg
+                        self.log_view.count(outcome, filename, tag='skip' if outcome == "跳过" else 'info')
+                        
                     elif msg_type == "complete":
-                        self.status_label.configure(text="已完成")
-                        self.start_button.configure(state=tk.NORMAL)
-                        self.stop_button.configure(state=tk.DISABLED)
-                        break
+                        self._finish_organize(msg)
                     
                 except queue.Empty:
                     break
+            
+            # 取样文件处理进度，每次检查最多更新一次界面
+            self._update_progress_display()
                 
             if self.running:
-                self.root.after(100, self.check_progress_queue)  # 增加检查间隔到100ms
+                self.root.after(100, self.check_progress_queue)  # 每100ms检查一次（10 Hz）
                 
         except Exception as e:
             self.logger.error(f"检查进度队列时出错: {str(e)}")
 
+    def _update_progress_display(self):
+        """按引擎的进度取样更新进度条和状态文字"""
+        snapshot = self.engine.progress.snapshot()
+        if snapshot is None or snapshot == self._last_progress:
+            return
+        self._last_progress = snapshot
+        self.progress_var.set(snapshot['percent'])
+        self.progress_percent.configure(text=f"{snapshot['percent']:.1f}%")
+        self.progress_status.configure(text=snapshot['status'])
+
     def calculate_eta(self):
         """计算计剩余时间"""
         try:
@@ -1234,215 +1328,6 @@ class PhotoOrganizerGUI:
         else:
             return "1分钟"  # 不到1分钟也显示1分钟
 
-    def process_single_file(self, file_path, target_dir):
-        """处理单个文件"""
-        try:
-            # 获取文件时间
-            file_time = self.get_file_time(file_path)
-            if not file_time:
-                raise ValueError("无法获取文件时间")
-            
-            # 获取件分类
-            category = self.get_file_category(file_path)
-            
-            # 构建目标路径
-            year = file_time.strftime("%Y")
-            month = file_time.strftime("%m")
-            filename = os.path.basename(file_path)
-            
-            # 构建目标目录
-            if self.organize_by_month_var.get() == "month":
-                if category == 'photos':
-                    target_subdir = os.path.join(target_dir, year, month)
-                else:
-                    target_subdir = os.path.join(target_dir, year, month, category)
-            else:
-                if category == 'photos':
-                    target_subdir = os.path.join(target_dir, year)
-                else:
-                    target_subdir = os.path.join(target_dir, year, category)
-            
-            # 检源文件是否已经在正确的位置
-            current_dir = os.path.dirname(file_path)
-            if os.path.normpath(current_dir) == os.path.normpath(target_subdir):
-                self.logger.info(f"文件已在正确位置: {file_path}")
-                return True  # 直接返回True，需要使用add方法
-            
-            # 确保目标目录存在
-            os.makedirs(target_subdir, exist_ok=True)
-            
-            # 构建目标文路径
-            target_path = os.path.join(target_subdir, filename)
-            
-            # 如果目标件已存在，添序号
-            if os.path.exists(target_path):
-                # 如果是相文件，跳过处理
-                if os.path.samefile(file_path, target_path):
-                    self.logger.info(f"跳过相同文件: {file_path}")
-                    # 同样更新进度
-                    self.progress_queue.put(("progress", self.processed_files / self.total_files * 100))
-                    return True
-                
-                # 检查文件大小是否相同
-                if os.path.getsize(file_path) == os.path.getsize(target_path):
-                    self.logger.info(f"目标位置已存在相同大小的文件，跳过: {filename}")
-                    # 更新进度
-                    self.progress_queue.put(("progress", self.processed_files / self.total_files * 100))
-                    return True
-                
-                # 如果文件不同，添加序号
-                base, ext = os.path.splitext(filename)
-                counter = 1
-                while os.path.exists(target_path):
-                    new_filename = f"{base}_{counter}{ext}"
-                    target_path = os.path.join(target_subdir, new_filename)
-                    counter += 1
-            
-            # 移动或复文件
-            try:
-                if self.move_files_var.get():
-                    shutil.move(file_path, target_path)
-                    self.logger.info(f"已移动: {filename} -> {target_path}")
-                else:
-                    shutil.copy2(file_path, target_path)
-                    self.logger.info(f"已复制: {filename} -> {target_path}")
-                return True  # 返回 True 表示处理成功
-            
-            except Exception as e:
-                self.logger.error(f"处理文件失败 {file_path}: {str(e)}")
-                raise
-            
-        except Exception as e:
-            raise ValueError(f"文件操作失败: {str(e)}")
-
-    def get_file_time(self, file_path):
-        """获取文件的时间信息"""
-        def is_valid_year(year):
-            """检查年份是否有效（1970-2100）"""  # 修复"份"字
-            return 1970 <= year <= 2100
-
-        methods = []
-        if self.time_method_vars[0].get():  # EXIF
-            methods.append(self.get_exif_time)
-        if self.time_method_vars[1].get():  # 文件名
-            methods.append(self.get_filename_time)
-        if self.time_method_vars[2].get():  # 修改时间
-            methods.append(self.get_modified_time)
-            
-        for method in methods:
-            try:
-                time = method(file_path)
-                if time and is_valid_year(time.year):
-                    return time
-            except:
-                continue
-                
-        # 如果所有方都失败，使用当前时间
-        self.logger.warning(f"无法获取有效的文件时间，用当时间: {file_path}")
-        return datetime.now()
-
-    def get_exif_time(self, file_path):
-        """从EXIF信息获取间"""
-        try:
-            with Image.open(file_path) as img:
-                exif = img._getexif()
-                if exif:
-                    for tag_id in [36867, 36868, 306]:  # DateTimeOriginal, DateTimeDigitized, DateTime
-                        if tag_id in exif:
-                            return datetime.strptime(exif[tag_id], '%Y:%m:%d %H:%M:%S')
-        except:
-            pass
-        return None
-
-    def get_filename_time(self, file_path):
-        """从文件名获取时间"""  # 修复"获取"
-        filename = os.path.basename(file_path)
-        self.logger.info(f"开始解析文件名: {filename}")  # 修复"开始"
-        
-        # 先尝试匹配 YYYYMMDD 格式
-        date_match = re.match(r'(\d{8}).*', filename)
-        if date_match:
-            try:
-                date_str = date_match.group(1)
-                year = int(date_str[:4])
-                month = int(date_str[4:6])
-                day = int(date_str[6:8])
-                
-                self.logger.info(f"从文件名取日期: {year}年{month}月{day}日")
-                
-                if 1970 <= year <= 2100 and 1 <= month <= 12 and 1 <= day <= 31:
-                    return datetime(year, month, day)
-            except (ValueError, IndexError) as e:
-                self.logger.warning(f"日期解析失败: {str(e)}")
-        
-        # 如果上面的匹配失败，再尝试其他
-        patterns = [
-            r'(\d{4})[-_]?(\d{2})[-_]?(\d{2})',  # YYYY-MM-DD
-            r'(\d{4})(\d{2})(\d{2})_\d{6}',      # 信格
-            r'IMG_(\d{4})(\d{2})(\d{2})',        # 机格式
-            r'Screenshot_(\d{4})(\d{2})(\d{2})'   # 截图格式
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, filename)
-            if match:
-                try:
-                    groups = match.groups()
-                    self.logger.info(f"匹配到模式: {pattern}, 分组: {groups}")  # 加调试日志
-                    
-                    if len(groups) == 1:
-                        # 处理8位数字的 (YYYYMMDD)
-                        date_str = groups[0]
-                        year = int(date_str[:4])
-                        month = int(date_str[4:6])
-                        day = int(date_str[6:8])
-                    else:
-                        # 处理年月日分组的情况
-                        year = int(groups[0])
-                        month = int(groups[1])
-                        day = int(groups[2])
-                    
-                    # 验证日的有效性
-                    if 1970 <= year <= 2100 and 1 <= month <= 12 and 1 <= day <= 31:
-                        result_date = datetime(year, month, day)
-                        self.logger.info(f"成功解析日期: {result_date}")  # 加调试日志
-                        return result_date
-                    else:
-                        self.logger.info(f"效的日期值: {year}-{month}-{day}")
-                    
-                except (ValueError, IndexError) as e:
-                    self.logger.info(f"日期析失败: {str(e)}")
-                    continue
-        
-        self.logger.info(f"无法从文件名解析日期: {filename}")  # 修复"解析"
-        self.logger.info(f"无法从文件名解析日: {filename}")
-        return None
-
-    def get_modified_time(self, file_path):
-        """获文件修改时间"""
-        return datetime.fromtimestamp(os.path.getmtime(file_path))
-
-    def is_valid_file(self, file_path):
-        """检查是否为有效的图片文件"""
-        try:
-            if not os.path.isfile(file_path):
-                self.logger.debug(f"是文件: {file_path}")
-                return False
-            
-            if not file_path.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.heic')):
-                self.logger.debug(f"是支持图片格式: {file_path}")
-                return False
-            
-            file_size = os.path.getsize(file_path)
-            if not (0 < file_size < 500 * 1024 * 1024):
-                self.logger.debug(f"文件大小不符合要求: {file_path} ({file_size} bytes)")
-                return False
-            
-            return True
-        except Exception as e:
-            self.logger.error(f"检查文件有效性时出错 {file_path}: {str(e)}")
-            return False
-
     def load_settings(self):
         """加载设置"""
         try:
@@ -1480,17 +1365,23 @@ class PhotoOrganizerGUI:
                 # 设置其选项
                 if 'move_files' in settings:
                     self.move_files_var.set(settings['move_files'])
+                if 'copy_mode' in settings:
+                    self.copy_mode_var.set(settings['copy_mode'])
                 if 'include_subfolders' in settings:
                     self.include_subfolders_var.set(settings['include_subfolders'])
                 if 'cleanup_enabled' in settings:
                     self.cleanup_enabled.set(settings['cleanup_enabled'])
                 if 'check_duplicates' in settings:
                     self.check_duplicates_var.set(settings['check_duplicates'])
+                if 'check_similar' in settings:
+                    self.check_similar_var.set(settings['check_similar'])
                 if 'organize_by_month' in settings:
                     self.organize_by_month_var.set(settings['organize_by_month'])
                 if 'time_methods' in settings:
                     for var, value in zip(self.time_method_vars, settings['time_methods']):
                         var.set(value)
+                if 'filename_first' in settings:
+                    self.filename_first_var.set(settings['filename_first'])
                 
                 self.logger.info("已应用保存的配置")  # 修复"配置"
         except Exception as e:
@@ -1504,11 +1395,15 @@ class PhotoOrganizerGUI:
                 'source_dir': self.source_entry.get().strip(),
                 'target_dir': self.target_entry.get().strip(),
                 'move_files': self.move_files_var.get(),
+                'copy_mode': self.copy_mode_var.get(),
                 'include_subfolders': self.include_subfolders_var.get(),
                 'cleanup_enabled': self.cleanup_enabled.get(),
                 'check_duplicates': self.check_duplicates_var.get(),
+                'check_similar': self.check_similar_var.get(),
                 'organize_by_month': self.organize_by_month_var.get(),
-                'time_methods': [var.get() for var in self.time_method_vars]
+                'time_methods': [var.get() for var in self.time_method_vars],
+                'filename_first': self.filename_first_var.get(),
+                'file_log_level': self.settings.get('file_log_level', 'info')
             }
             
             # 只有当路径为空时才保存
@@ -1519,6 +1414,10 @@ class PhotoOrganizerGUI:
         except Exception as e:
             self.logger.error(f"保存配置失败: {str(e)}")
         
+        # 停止处理，关闭线程池和缓存
+        self.running = False
+        self.engine.close()
+        
         self.root.destroy()
 
     def on_organize_method_change(self, *args):
@@ -1527,152 +1426,11 @@ class PhotoOrganizerGUI:
         self.logger.info(f"整理方已更改: {'按年月' if is_by_month else '仅按年'}")
         self.save_settings()
 
-    def check_duplicate_files(self, target_dir):
-        """查标目录中的重复文件"""
-        try:
-            self.logger.info("开检查重复文件...")
-            self.progress_queue.put(("message", "开始检查重复文件..."))
-            
-            # 用字典存储件大小内容的哈值
-            file_dict = {}  # {(size, hash): [file_paths]}
-            total_files = 0
-            duplicate_count = 0
-            
-            # 历目标目录
-            for root, _, files in os.walk(target_dir):
-                total_files += len(files)
-                
-            processed = 0
-            
-            for root, _, files in os.walk(target_dir):
-                for filename in files:
-                    if not self.running:
-                        return
-                        
-                    file_path = os.path.join(root, filename)
-                    try:
-                        # 获文件大小
-                        file_size = os.path.getsize(file_path)
-                        
-                        # 计算文件希值只读前8KB提高速度）
-                        with open(file_path, 'rb') as f:
-                            file_hash = hash(f.read(8192))
-                        
-                        # 使用文件大小和哈值作键
-                        key = (file_size, file_hash)
-                        
-                        if key in file_dict:
-                            file_dict[key].append(file_path)
-                            duplicate_count += 1
-                        else:
-                            file_dict[key] = [file_path]
-                            
-                        processed += 1
-                        progress = (processed / total_files) * 100
-                        self.progress_queue.put(("progress", progress))
-                        
-                    except Exception as e:
-                        self.logger.error(f"处理文件失败 {file_path}: {str(e)}")
-                        continue
-            
-            # 处理重复
-            if duplicate_count > 0:
-                self.logger.info(f"发现 {duplicate_count} 个重复文件")
-                self.progress_queue.put(("message", f"现 {duplicate_count} 个重复文件"))
-                
-                for key, file_paths in file_dict.items():
-                    if len(file_paths) > 1:
-                        # 保留最新的文件
-                        newest_file = max(file_paths, key=os.path.getctime)
-                        file_paths.remove(newest_file)
-                        
-                        # 删除其他重复文件
-                        for file_path in file_paths:
-                            try:
-                                os.remove(file_path)
-                                self.logger.info(f"删重文件: {file_path}")
-                                self.progress_queue.put(("message", f"删除重复文件: {os.path.basename(file_path)}"))
-                            except Exception as e:
-                                self.logger.error(f"删除文件失败 {file_path}: {str(e)}")
-            
-            self.progress_queue.put(("message", "重复文件检查完成"))
-            self.logger.info("重复文件检查完成")
-            
-        except Exception as e:
-            self.logger.error(f"检查重复文件时出错: {str(e)}")
-            self.progress_queue.put(("message", f"检查重复文件时错: {str(e)}"))
-
-    def cleanup_empty_dirs(self, target_dir):
-        """清理空目录无效目录"""
-        try:
-            self.logger.info("开始清理目录...")
-            self.progress_queue.put(("message", "开清目录..."))
-            
-            # 要删除的特殊文件/目录模式
-            special_patterns = [
-                '.DS_Store',      # Mac系统文件
-                'Thumbs.db',      # Windows缩略图文件
-                '._.DS_Store',    # Mac元数
-                '._*',            # Mac隐藏文件
-                'desktop.ini',    # Windows面置文件
-                '.spotlight*',    # Mac Spotlight索引
-                '.fseventsd',     # Mac文件系事件
-                '.Trashes'        # Mac收
-            ]
-            
-            cleaned_count = 0
-            
-            # 从下往上遍历目录（先处理子目录）
-            for root, dirs, files in os.walk(target_dir, topdown=False):
-                # 删除特殊文件
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    # 检查是否配特殊件模式
-                    if any(fnmatch.fnmatch(file.lower(), pattern.lower()) for pattern in special_patterns):
-                        try:
-                            os.remove(file_path)
-                            self.logger.info(f"删除特文件: {file_path}")
-                            cleaned_count += 1
-                        except Exception as e:
-                            self.logger.error(f"删除文件失败 {file_path}: {str(e)}")
-                
-                # 检查目录是否为空或只包含特殊文件
-                try:
-                    # 重获取目录内容（因可能已删除了些文件）
-                    remaining_files = [f for f in os.listdir(root) 
-                                     if not any(fnmatch.fnmatch(f.lower(), p.lower()) 
-                                              for p in special_patterns)]
-                    
-                    # 如果目录为空或包含特件
-                    if not remaining_files:
-                        # 保不目标根目录
-                        if root != target_dir:
-                            try:
-                                # 除有剩内容并删除目录
-                                shutil.rmtree(root)
-                                self.logger.info(f"删除空目录: {root}")
-                                cleaned_count += 1
-                            except Exception as e:
-                                self.logger.error(f"删除目录失败 {root}: {str(e)}")
-                
-                except Exception as e:
-                    self.logger.error(f"处理目录失败 {root}: {str(e)}")
-            
-            self.logger.info(f"清理成，共清理 {cleaned_count} 个项目")
-            self.progress_queue.put(("message", f"清理完成，共清理 {cleaned_count} 个项目"))
-            
-        except Exception as e:
-            self.logger.error(f"清理过出错: {str(e)}")
-            self.progress_queue.put(("message", f"清理错误: {str(e)}"))
-
     def clear_log(self):
         """清理日志内容"""
         try:
-            # 临时禁用文本框更新以避免闪烁
-            self.log_text.configure(state='disabled')
-            
-            # 清空日志文本框
-            self.log_text.delete(1.0, tk.END)
+            # 清空日志记录
+            self.log_view.clear()
             
             # 重置进度条和状态显示
             self.progress_var.set(0)
@@ -1684,27 +1442,12 @@ class PhotoOrganizerGUI:
             self.v_scrollbar.grid_remove()
             self.h_scrollbar.grid_remove()
             
-            # 重新启用文本框
-            self.log_text.configure(state='normal')
-            
             # 添加清理完成的消息
             self.log_message("日志已清理")
             
-            # 强制更新布局
-            self.log_text.update_idletasks()
-            
         except Exception as e:
             self.logger.error(f"清理日志失败: {str(e)}")
 
-    def update_scrollbar_y(self, *args):
-        """更新垂直滚动条"""
-        self.v_scrollbar.set(*args)
-        # 当内不需要滚动时隐藏滚动条
-        if float(args[1]) >= 1.0:
-            self.v_scrollbar.grid_remove()
-        else:
-            self.v_scrollbar.grid()
-
     def update_scrollbar_x(self, *args):
         """更水滚动条"""
         self.h_scrollbar.set(*args)
@@ -1743,13 +1486,16 @@ class PhotoOrganizerGUI:
                 # 重置所有控件状态为默认值
                 self.organize_by_month_var.set("month")
                 self.move_files_var.set(False)
+                self.copy_mode_var.set("copy")
                 self.include_subfolders_var.set(True)
                 self.cleanup_enabled.set(True)
                 self.check_duplicates_var.set(True)
+                self.check_similar_var.set(False)
                 
                 # 重置时间获取方式
                 for var in self.time_method_vars:
                     var.set(True)
+                self.filename_first_var.set(False)
                 
                 # 清空路径
                 self.source_entry.delete(0, tk.END)
@@ -1765,14 +1511,16 @@ class PhotoOrganizerGUI:
                 self.start_button.configure(state=tk.NORMAL)
                 self.stop_button.configure(state=tk.DISABLED)
                 
-                # 清空日志文本框
-                self.log_text.delete(1.0, tk.END)
+                # 清空日志记录
+                self.log_view.clear()
                 
                 # 重置处理计数器
+                self.engine.reset_stats()
                 self.total_files = 0
                 self.processed_files = 0
                 self.skipped_files = 0
                 self.duplicate_files = 0
+                self.similar_groups = 0
                 self.cleaned_dirs = 0
                 self.error_files = []
                 
@@ -1785,6 +1533,12 @@ class PhotoOrganizerGUI:
                 self.logger.error(f"重置配置失败: {str(e)}")
                 self.log_message(f"重置配置失败: {str(e)}", level='error')
 
+    def _operation_name(self):
+        """当前的文件操作方式，用于日志和结果显示"""
+        if self.move_files_var.get():
+            return "移动"
+        return {"hardlink": "硬链接", "reflink": "写时复制"}.get(self.copy_mode_var.get(), "复制")
+
     def get_organize_by_month(self):
         """获取是否按月整理的态"""
         return self.organize_by_month_var.get() == "month"
@@ -1807,7 +1561,7 @@ class PhotoOrganizerGUI:
         self.log_text = tk.Text(
             text_inner,
             font=self.fonts['body'],
-            wrap=tk.WORD,
+            wrap=tk.NONE,
             relief='flat',
             bg=self.colors['bg_light'],
             height=3,  # 固定为3行
@@ -1830,14 +1584,12 @@ class PhotoOrganizerGUI:
             spacing1=self.scaled(2))
         
         # 创建滚动条
-        self.v_scrollbar = ttk.Scrollbar(text_inner, orient="vertical", command=self.log_text.yview)
+        self.v_scrollbar = ttk.Scrollbar(text_inner, orient="vertical")
         self.h_scrollbar = ttk.Scrollbar(text_inner, orient="horizontal", command=self.log_text.xview)
         
-        # 配置文本框的滚动
-        self.log_text.configure(
-            yscrollcommand=self.update_scrollbar_y,
-            xscrollcommand=self.update_scrollbar_x
-        )
+        # 配置文本框的滚动，垂直方向由 LogView 处理
+        self.log_text.configure(xscrollcommand=self.update_scrollbar_x)
+        self.log_view = LogView(self.log_text, self.v_scrollbar)
         
         # 使用网格布局
         self.log_text.grid(row=0, column=0, sticky="nsew")
@@ -2025,64 +1777,44 @@ class PhotoOrganizerGUI:
         self.include_subfolders_var.set(default_settings.get('include_subfolders', True))
         self.cleanup_enabled.set(default_settings.get('cleanup_enabled', True))
         self.check_duplicates_var.set(default_settings.get('check_duplicates', True))
+        self.check_similar_var.set(default_settings.get('check_similar', False))
         self.organize_by_month_var.set(default_settings.get('organize_by_month', 'month'))
         # ... 其他设置
 
-    def get_file_category(self, file_path):
-        """获取文件分类"""
-        filename = os.path.basename(file_path).lower()
-        
-        # 定义文件类型模式
-        patterns = {
-            'screenshots': [
-                r'^screenshot[_-]',      # Screenshot开头
-                r'截图',
-                r'屏幕截图',
-                r'snipaste',
-                r'capture',
-                r'snip',
-                r'lightshot',
-                r'screen\s*shot',
-                r'截屏',
-                r'快照',
-            ],
-            'others': [                 
-                r'^\d{13}-[a-zA-Z0-9_]+',
-                r'信图片',
-                r'wx_camera',
-                r'mmexport',
-                r'img_[0-9]{13}',
-                r'weixin',
-                r'qq',
-                r'edit',
-                r'modified',
-                r'(copy)',
-                r'副本',
-                r'修改',
-            ]
-        }
-        
-        # 检查文件名是否匹配任何模式
-        for category, pattern_list in patterns.items():
-            for pattern in pattern_list:
-                if re.search(pattern, filename, re.IGNORECASE):
-                    return category
-        
-        # 尝试通过EXIF判断是否为相机照片（仅对图片文件）
-        try:
-            with Image.open(file_path) as img:
-                exif = img._getexif()
-                if exif and (271 in exif or 272 in exif):  # 检查制造商或型号
-                    return 'photos'
-        except:
-            pass
-        
-        # 默认返回 photos 类别
-        return 'photos'
+    def rebuild_cache(self):
+        """清空元数据缓存，下次整理时重新生成"""
+        if self.running:
+            messagebox.showinfo("提示", "请在整理结束后再重建缓存")
+            return
+        if self.engine.metadata_cache is None:
+            messagebox.showinfo("提示", "元数据缓存不可用")
+            return
+        if messagebox.askyesno("确认", "确定要重建缓存吗？\n下次整理时将重新读取所有文件信息，\n重复检查将重新扫描目标目录。"):
+            try:
+                self.engine.clear_caches()
+                self.logger.info("元数据缓存和图库索引已清空")
+                self.log_message("缓存已清空，下次整理时重新生成")
+            except Exception as e:
+                self.logger.error(f"重建缓存失败: {str(e)}")
+                self.log_message(f"重建缓存失败: {str(e)}", level='error')
+
+    def _probe_system_config(self):
+        """后台获取优化配置，下次开始整理时生效"""
+        max_workers, batch_size = self.get_optimal_config()
+        self.max_workers, self.batch_size = max_workers, batch_size
+        self.engine.max_workers = max_workers
+        self.engine.batch_size = batch_size
+
+    def report_startup_time(self):
+        """记录从启动到窗口显示的耗时"""
+        self.startup_time = time.perf_counter() - LAUNCH_TIME
+        self.logger.info(f"启动耗时: {self.startup_time * 1000:.0f}ms")
+        return self.startup_time
 
     def get_optimal_config(self):
-        """取优化配置"""  # 修复"配置"
+        """取优化配置（会阻塞约 1 秒，不要在主线程调用）"""  # 修复"配置"
         try:
+            import psutil
             # 获取系统信息
             cpu_count = multiprocessing.cpu_count()
             memory = psutil.virtual_memory()
@@ -2119,52 +1851,10 @@ class PhotoOrganizerGUI:
             self.logger.error(f"获取系统配置失败: {str(e)}")  # 修复"配置"
             return 2, 30  # 使用更保守的默认值
 
-    def get_all_files(self, source_dir):
-        """获取所有需要处理的文件"""
-        try:
-            all_files = []
-            total_size = 0
-            start_time = time.time()
-            
-            # 支持的文件类型
-            supported_extensions = {
-                '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.heic', '.raw', '.cr2', '.nef', '.arw',  # 图片格式
-                '.mp4', '.mov', '.avi', '.mkv', '.wmv', '.m4v', '.3gp'  # 视频格式
-            }
-            
-            # 使用 os.walk 快速扫描
-            if self.include_subfolders_var.get():
-                for root, _, files in os.walk(source_dir):
-                    for filename in files:
-                        ext = os.path.splitext(filename.lower())[1]
-                        if ext in supported_extensions:  # 统一判断所有支持的格式
-                            file_path = os.path.join(root, filename)
-                            all_files.append(file_path)
-                            
-                            # 每1000个文件更新一次状
-                            if len(all_files) % 1000 == 0:
-                                elapsed = time.time() - start_time
-                                speed = len(all_files) / elapsed if elapsed > 0 else 0
-                                self.progress_queue.put(("status", 
-                                    f"正在扫描文件... 已找到 {len(all_files)} 个文件 ({speed:.0f} 文件/秒)"))
-            else:
-                # 仅扫描根目录
-                with os.scandir(source_dir) as entries:
-                    for entry in entries:
-                        if entry.is_file():
-                            ext = os.path.splitext(entry.name.lower())[1]
-                            if ext in supported_extensions:  # 统一判断所有支持的格式
-                                all_files.append(entry.path)
-            
-            return all_files
-            
-        except Exception as e:
-            self.logger.error(f"扫描文件时出错: {str(e)}", exc_info=True)
-            raise
-
     def monitor_system_resources(self):
         """监控系统资源使用情况"""
         try:
+            import psutil
             # 获取系统信息
             cpu_count = psutil.cpu_count()
             memory = psutil.virtual_memory()
@@ -2189,31 +1879,10 @@ class PhotoOrganizerGUI:
         except Exception as e:
             self.logger.error(f"控系统资源失败: {str(e)}")
 
-    def _process_batch(self, batch, target_dir):
-        """优化的批处理"""
-        results = []
-        batch_size = len(batch)
-        
-        for i, file_path in enumerate(batch):
-            if not self.running:
-                break
-                
-            try:
-                result = self.process_single_file(file_path, target_dir)
-                if result == True:
-                    results.append((file_path, True, "skipped"))
-                else:
-                    results.append((file_path, True, None))
-                
-            except Exception as e:
-                self.logger.error(f"处理文件失败 {file_path}: {str(e)}", exc_info=True)
-                results.append((file_path, False, str(e)))
-        
-        return results
-
     def _optimize_system_resources(self):
         """智能优化系统资源配置"""
         try:
+            import psutil
             # 获取系统详细信息
             cpu_count = psutil.cpu_count(logical=True)  # 逻辑CPU核心数
             total_memory = psutil.virtual_memory().total / (1024 * 1024 * 1024)  # 总内存(GB)
@@ -2419,4 +2088,13 @@ if __name__ == "__main__":
     # 设置窗口位置和大小
     root.geometry(f"{natural_width}x{natural_height}+{x}+{y}")
     
+    # 窗口显示后记录启动耗时；--measure-startup 时输出耗时后直接退出，便于比较不同版本
+    def on_first_idle():
+        startup_time = app.report_startup_time()
+        if '--measure-startup' in sys.argv:
+            print(f"startup: {startup_time * 1000:.0f} ms")
+            app.engine.close()
+            root.destroy()
+    root.after_idle(on_first_idle)
+    
     root.mainloop()
\ No newline at end of file